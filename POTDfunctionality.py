@@ -1,8 +1,24 @@
 from discordHelper import *
+from storage.journal import JournalStore
+from bisect import bisect_left, insort
+import heapq, inspect
 import random
 
 helper = discordHelper(None, None)
 
+def journaled(func):
+    '''records every call to a mutator in its owner's store so it can be replayed on load'''
+    signature = inspect.signature(func)
+    def wrapped_func(self, *args, **kwargs):
+        # arguments passed by keyword are recorded by position, so stores can index them
+        bound = signature.bind(self, *args, **kwargs)
+        value = func(self, *args, **kwargs)
+        self.record(func.__name__, *bound.args[1:], **bound.kwargs)
+        return value
+    wrapped_func.__name__ = func.__name__
+    wrapped_func.__doc__ = func.__doc__
+    return wrapped_func
+
 class Person:
     def __init__(self, person_id, num_attempts=0, grade='0', responses=[]):
         self.num_attempts = num_attempts
@@ -11,7 +27,7 @@ class Person:
         self.responses = responses[:]
 
     def to_load(self):
-        return {'id': self.id, 'num_attempts': self.num_attempts, 'grade': self.grade, 'responses': self.responses}
+        return {'id': self.id, 'num_attempts': self.num_attempts, 'grade': self.grade, 'responses': self.responses[:]}
 
 class Problem:
     g_problem_id = 0
@@ -27,17 +43,16 @@ class Problem:
 
         self.problem_text = str(problem_text)
         self.answer = str(answer)
-        self.start_time = start_time
-        self.end_time = end_time
+        self.set_time(start_time, end_time)
         self.season_id = season_id
 
         self.persons = {}
 
     ############### helpers
 
-    def in_interval(self):
-        return pd.Timestamp(self.start_time, tz=timezone) <= pd.Timestamp.now(tz=timezone) and \
-               pd.Timestamp(self.end_time, tz=timezone) >= pd.Timestamp.now(tz=timezone)
+    def in_interval(self, now: int = None):
+        if now is None: now = now_epoch()
+        return self.start_epoch <= now <= self.end_epoch
 
     ############### ACCESSORS
 
@@ -82,6 +97,14 @@ class Problem:
         self.season_id = season_id
         return True, f"Season ID set successfully."
 
+    def set_time(self, start_time: str, end_time: str):
+        # strings are what gets stored, epochs are what gets compared. parsed first, so a bad time
+        # leaves the problem as it was
+        start_epoch, end_epoch = to_epoch(start_time), to_epoch(end_time)
+        self.start_time, self.end_time = start_time, end_time
+        self.start_epoch, self.end_epoch = start_epoch, end_epoch
+        return True, f"Time set successfully."
+
     ############### SCORES
 
     def solve_scores(self):
@@ -114,22 +137,139 @@ class Problem:
         for person in load:
             self.set_person(person['id'], person['num_attempts'], person['grade'], person['responses'])
 
+class Leaderboard:
+    '''running point totals for one season, kept sorted for rank queries'''
+    def __init__(self):
+        self.contributions = {}  # person_id -> {problem_id: score}
+        self.totals = {}         # person_id -> total score
+        self.order = []          # sorted (-total, person_id)
+
+    def set_contribution(self, person_id: str, problem_id: str, score: float = None):
+        contributions = self.contributions.setdefault(person_id, {})
+        if contributions.get(problem_id) == score: return
+        if score is None: contributions.pop(problem_id, None)
+        else: contributions[problem_id] = score
+
+        if person_id in self.totals:
+            del self.order[bisect_left(self.order, (-self.totals[person_id], person_id))]
+        if contributions:
+            self.totals[person_id] = sum(contributions.values())
+            insort(self.order, (-self.totals[person_id], person_id))
+        else:
+            self.totals.pop(person_id, None)
+            del self.contributions[person_id]
+
+    def scores(self):
+        return dict(self.totals)
+
+    def top(self, k: int = None):
+        '''[(person_id, score)] for the k highest totals, everyone if k is None'''
+        return [(person_id, -score) for score, person_id in (self.order if k is None else self.order[:k])]
+
+    def rank(self, person_id: str):
+        '''(rank, score) of person_id, ties share the lowest rank; None if they have no points'''
+        if person_id not in self.totals: return None
+        score = self.totals[person_id]
+        return bisect_left(self.order, (-score,)) + 1, score
+
+    @staticmethod
+    def from_scores(scores: dict):
+        leaderboard = Leaderboard()
+        for person_id, score in scores.items():
+            leaderboard.set_contribution(person_id, "*", score)
+        return leaderboard
+
+class IntervalIndex:
+    '''[start, end] intervals by key, answering "which intervals contain this point" through a centered interval tree'''
+    def __init__(self):
+        self.intervals = {}
+        # rebuilt on the first query after a change, problems change far less often than they are looked up
+        self.tree = None
+
+    def set(self, key, start, end):
+        self.intervals[key] = (start, end)
+        self.tree = None
+
+    def remove(self, key):
+        if self.intervals.pop(key, None) is not None:
+            self.tree = None
+
+    @staticmethod
+    def build(items):
+        if not items: return None
+        points = sorted(point for key, interval in items for point in interval)
+        center = points[len(points) // 2]
+        here = [(key, (start, end)) for key, (start, end) in items if start <= center <= end]
+        return (
+            center,
+            sorted((start, key) for key, (start, end) in here),
+            sorted(((end, key) for key, (start, end) in here), reverse=True),
+            IntervalIndex.build([(key, (start, end)) for key, (start, end) in items if end < center]),
+            IntervalIndex.build([(key, (start, end)) for key, (start, end) in items if start > center])
+        )
+
+    def stab(self, point):
+        if self.tree is None: self.tree = IntervalIndex.build(list(self.intervals.items()))
+        found, node = [], self.tree
+        while node is not None:
+            center, by_start, by_end, left, right = node
+            if point < center:
+                for start, key in by_start:
+                    if start > point: break
+                    found.append(key)
+                node = left
+            elif point > center:
+                for end, key in by_end:
+                    if end < point: break
+                    found.append(key)
+                node = right
+            else:
+                found.extend(key for start, key in by_start)
+                break
+        return found
+
 class Season:
     def __init__(self):
         self.ungraded_answers = []
         self.problems = {}
         self.CURRENT_SEASON = 0
+        self.store = None
+
+        # season_id -> Leaderboard, problem_id -> (season_id, {person_id: score})
+        self.leaderboards = {}
+        self.problem_scores = {}
+
+        # season_id -> {problem_id}, problem_id -> indexed season_id, and problem time windows
+        self.season_problems = {}
+        self.problem_seasons = {}
+        self.open_problems = IntervalIndex()
+
+    def record(self, op, *args, **kwargs):
+        if self.store is not None and not self.store.replaying: self.store.record(op, args, kwargs)
 
     ################ ACCESSORS
 
     def get_problem(self, problem_id: str):
         if problem_id in self.problems: return self.problems[problem_id]
+        if self.store is not None and self.store.partial:
+            # problem from a season that was not loaded into memory
+            load = self.store.get_problem(problem_id)
+            if load is not None:
+                self.problems[problem_id] = self.make_problem(load)
+                return self.problems[problem_id]
         return None
 
+    def get_season_problems(self, season_id: str):
+        return [self.problems[problem_id] for problem_id in self.season_problems.get(season_id, ())]
+
+    def get_open_problems(self, now: int = None):
+        '''problems currently accepting answers'''
+        if now is None: now = now_epoch()
+        return [self.problems[problem_id] for problem_id in self.open_problems.stab(now)]
+
     def get_last_ungraded(self, gnext = False):
         if self.ungraded_answers:
-            if gnext:
-                self.ungraded_answers = self.ungraded_answers[1:] + self.ungraded_answers[:1]
+            if gnext: self.rotate_ungraded()
             return True, self.ungraded_answers[0]
         else: 
             return False, None
@@ -139,12 +279,30 @@ class Season:
     def add_problem(self, problem_text: str, answer: str, start_time: str, end_time: str, season_id: str="None"):
         if season_id == "None": season_id = str(self.CURRENT_SEASON)
         problem = Problem(problem_text, answer, start_time, end_time, season_id)
-        self.problems[problem.id] = problem 
+        problem = self.load_problem(problem.to_load())
         return True, f"Problem added successfully", problem
 
+    def make_problem(self, load):
+        problem = Problem(load['problem_text'], load['answer'], load['start_time'], load['end_time'], load['season_id'], load['id'])
+        problem.from_load(load['persons'])
+        return problem
+
+    @journaled
+    def load_problem(self, load):
+        problem = self.make_problem(load)
+        self.problems[problem.id] = problem
+        self.index_problem(problem.id)
+        self.refresh_scores(problem.id)
+        return problem
+
+    @journaled
     def delete_problem(self, problem_id: str):
+        # in a partial load the problem may only be in the store
+        self.get_problem(problem_id)
         res = self.problems.pop(problem_id, None)
         res = (res == None)
+        self.index_problem(problem_id)
+        self.refresh_scores(problem_id)
         text = f"Problem {problem_id} " + ("not found." if res else "deleted.")
         return res, text
 
@@ -153,7 +311,7 @@ class Season:
         if not problem: return False, f"Problem {problem_id} not found."
         if not problem.in_interval(): return False, "Not in correct time interval."
 
-        self.ungraded_answers.append({
+        self.push_ungraded({
             'problem_id': problem_id, 
             'person_id': person_id, 
             'answer': answer,
@@ -161,6 +319,20 @@ class Season:
         })
         return True, "Answer added."
 
+    ################ UNGRADED QUEUE
+
+    @journaled
+    def push_ungraded(self, answer):
+        self.ungraded_answers.append(answer)
+
+    @journaled
+    def pop_ungraded(self):
+        self.ungraded_answers = self.ungraded_answers[1:]
+
+    @journaled
+    def rotate_ungraded(self):
+        self.ungraded_answers = self.ungraded_answers[1:] + self.ungraded_answers[:1]
+
     def get_answer_info(self, problem, person, answer):
         is_correct = any(float(response) == float(answer) for response in person.responses)
 
@@ -168,6 +340,7 @@ class Season:
         num_att_not_stored = person.num_attempts - index_of_correct - 1
 
         return is_correct, num_att_not_stored, index_of_correct
+    @journaled
     def set_answer(self, problem_id: str, answer: str):
         problem = self.get_problem(problem_id)
         if not problem: return False, f"Problem {problem_id} not found.", None
@@ -189,23 +362,29 @@ class Season:
                     people_updated.append((person_id, new_grade, new_attempts))
 
         result, text = problem.set_ans(answer)
+        self.refresh_scores(problem_id)
         return result, text, people_updated
     
+    @journaled
     def set_time(self, problem_id: str, start_time: str, end_time: str):
         problem = self.get_problem(problem_id)
         if not problem: return False, f"Problem {problem_id} not found."
-        problem.start_time = start_time
-        problem.end_time = end_time
-        return True, f"Time set successfully."
+        result, text = problem.set_time(start_time, end_time)
+        self.index_problem(problem_id)
+        return result, text
 
+    @journaled
     def set_season(self, problem_id: str, season_id: str):
         problem = self.get_problem(problem_id)
         if not problem: return False, f"Problem {problem_id} not found."
         result, text = problem.set_season(season_id)
+        self.index_problem(problem_id)
+        self.refresh_scores(problem_id)
         return result, text
 
     ################ PERSON MUTATORS 
 
+    @journaled
     def set_attempts(self, problem_id: str, person_id: str, num_attempts: int):
         problem = self.get_problem(problem_id)
         if not problem: return False, f"Problem {problem_id} not found.", None
@@ -214,8 +393,10 @@ class Season:
         if not result:
             result, text, person = problem.set_person(person_id, num_attempts, 0)
 
+        self.refresh_scores(problem_id)
         return result, text, person
     
+    @journaled
     def set_grade(self, problem_id: str, person_id: str, grade: float, max_out: bool = False):
         problem = self.get_problem(problem_id)
         if not problem: return False, f"Problem {problem_id} not found.", None
@@ -224,10 +405,12 @@ class Season:
         if not result:
             result, text, person = problem.set_person(person_id, 1, grade)
 
+        self.refresh_scores(problem_id)
         return result, text, person
 
     ################ GRADING
 
+    @journaled
     def grade_answer(self, problem_id: str, person_id: str, grade: float, attempts_to_update: int = 1):
         problem = self.get_problem(problem_id)
         if not problem: return False, f"Problem {problem_id} not found."
@@ -239,6 +422,7 @@ class Season:
             person.num_attempts += attempts_to_update
             person.grade = max(person.grade, grade)
 
+        self.refresh_scores(problem_id)
         return True, "Answer graded successfully."
 
     def grade_last(self, grade: float, attempts_to_update: int = 1):
@@ -248,7 +432,7 @@ class Season:
         result, text = self.grade_answer(last['problem_id'], last['person_id'], grade, attempts_to_update)
         if self.ungraded_answers[0]["filename"]:
             os.remove(f"{DATA_DIR}images/{self.ungraded_answers[0]['filename']}")
-        self.ungraded_answers = self.ungraded_answers[1:]
+        self.pop_ungraded()
         return result, text
 
     ################ LOAD
@@ -259,51 +443,150 @@ class Season:
     
     def from_load(self, load):
         for problem in load:
-            self.problems[problem['id']] = Problem(problem['problem_text'], problem['answer'], problem['start_time'], problem['end_time'], problem['season_id'], problem['id'])
-            self.problems[problem['id']].from_load(problem['persons'])
+            self.load_problem(problem)
 
     ################ GRADING 
 
+    def index_problem(self, problem_id: str):
+        '''brings the season and time window indexes in line with the problem's current state'''
+        old_season = self.problem_seasons.pop(problem_id, None)
+        if old_season is not None:
+            self.season_problems[old_season].discard(problem_id)
+            if not self.season_problems[old_season]: del self.season_problems[old_season]
+        self.open_problems.remove(problem_id)
+
+        problem = self.problems.get(problem_id)
+        if problem is None: return
+        self.season_problems.setdefault(problem.season_id, set()).add(problem_id)
+        self.problem_seasons[problem_id] = problem.season_id
+        self.open_problems.set(problem_id, problem.start_epoch, problem.end_epoch)
+
+    def refresh_scores(self, problem_id: str):
+        '''recomputes one problem's contribution to its season's leaderboard'''
+        old_season, old_scores = self.problem_scores.pop(problem_id, (None, {}))
+        problem = self.problems.get(problem_id)
+        new_season = problem.season_id if problem else None
+        new_scores = dict(problem.solve_scores()) if problem else {}
+
+        for person_id in old_scores:
+            if old_season != new_season or person_id not in new_scores:
+                self.leaderboards[old_season].set_contribution(person_id, problem_id, None)
+        if problem is None: return
+
+        leaderboard = self.leaderboards.setdefault(new_season, Leaderboard())
+        for person_id, score in new_scores.items():
+            leaderboard.set_contribution(person_id, problem_id, score)
+        self.problem_scores[problem_id] = (new_season, new_scores)
+
+    def get_leaderboard(self, season_id: str):
+        if self.store is not None and self.store.partial:
+            # only some seasons are in memory, the store has the full picture
+            return Leaderboard.from_scores(self.store.get_grades(season_id))
+        return self.leaderboards.get(season_id, Leaderboard())
+
     def get_grades(self, season_id: str):
-        scores = {}
-        for problem_id, problem in self.problems.items():
-            if problem.season_id != season_id:
-                continue
-            new_scores = problem.solve_scores()
-            for a, b in new_scores:
-                scores[a] = scores.get(a, 0) + b
-        return scores 
+        return self.get_leaderboard(season_id).scores()
+
+    def get_rankings(self, season_id: str, k: int = None):
+        return self.get_leaderboard(season_id).top(k)
+
+    def get_rank(self, season_id: str, person_id: str):
+        return self.get_leaderboard(season_id).rank(person_id)
 
 class Driver:
-    def __init__(self):
+    def __init__(self, store=None):
         self.season = Season()
         self.scheduled_messages = {}
+        # message id -> send time in epoch seconds, parsed once instead of on every check
+        self.scheduled_times = {}
+        # min-heap of (send time, message id), entries whose time no longer matches scheduled_times are stale
+        self.scheduled_heap = []
+        # message id -> failed sends so far, only kept in memory
+        self.scheduled_failures = {}
+        self.store = store if store is not None else JournalStore(f'{DATA_DIR}data/')
+        self.store.driver = self
+        self.season.store = self.store
+
+    def record(self, op, *args, **kwargs):
+        # nothing is journaled while the store replays its own records
+        if not self.store.replaying: self.store.record(op, args, kwargs)
+
+    def replay(self, op, args, kwargs):
+        target = self if op in ['set_scheduled_message', 'remove_scheduled_message'] else self.season
+        getattr(target, op)(*args, **kwargs)
     
+    ################ SCHEDULED MESSAGES
+
     def add_scheduled_message(self, message):
-        self.scheduled_messages[str(unique_id())] = message
+        self.set_scheduled_message(str(unique_id()), message)
+
+    @journaled
+    def set_scheduled_message(self, message_id, message):
+        # parsed first, so a bad time raises before anything is stored
+        send_time = to_epoch(message["time"])
+        self.scheduled_messages[message_id] = message
+        self.scheduled_times[message_id] = send_time
+        heapq.heappush(self.scheduled_heap, (send_time, message_id))
+
+    @journaled
+    def remove_scheduled_message(self, message_id):
+        self.scheduled_times.pop(message_id, None)
+        self.scheduled_failures.pop(message_id, None)
+        return self.scheduled_messages.pop(message_id, None)
+
+    def next_scheduled_time(self):
+        '''epoch seconds of the next scheduled message, None if nothing is scheduled'''
+        while self.scheduled_heap and self.scheduled_times.get(self.scheduled_heap[0][1]) != self.scheduled_heap[0][0]:
+            heapq.heappop(self.scheduled_heap)
+        return self.scheduled_heap[0][0] if self.scheduled_heap else None
+
+    def pop_due_scheduled_message(self, now: int = None):
+        '''takes the earliest scheduled message whose time has come off the heap, (id, message) or None'''
+        if now is None: now = now_epoch()
+        next_time = self.next_scheduled_time()
+        if next_time is None or next_time > now: return None
+        _, message_id = heapq.heappop(self.scheduled_heap)
+        return message_id, self.scheduled_messages[message_id]
+
+    def retry_scheduled_message(self, message_id, delay: int = 60, max_attempts: int = 5):
+        '''
+        puts a message that failed to send back on the heap, waiting delay, 2 * delay, ... seconds. its
+        stored time is left alone. returns False once the message has failed max_attempts times
+        '''
+        if message_id not in self.scheduled_messages: return False
+        failures = self.scheduled_failures.get(message_id, 0) + 1
+        if failures >= max_attempts: return False
+        self.scheduled_failures[message_id] = failures
+        self.scheduled_times[message_id] = now_epoch() + delay * 2 ** (failures - 1)
+        heapq.heappush(self.scheduled_heap, (self.scheduled_times[message_id], message_id))
+        return True
 
     def create_season(self, val=1):
         self.season.CURRENT_SEASON += val
 
-    def store_data(self):
-        with open(f'{DATA_DIR}data/data.json', 'w') as file:
-            json.dump(self.season.to_load(), file, indent=4)
+    ################ LOAD & STORE
 
-        with open(f'{DATA_DIR}data/ungraded.json', 'w') as file:
-            json.dump(self.season.ungraded_answers, file, indent=4)
+    def to_load(self):
+        return {
+            'problems': self.season.to_load(),
+            # copies, a snapshot may be serialized off the event loop
+            'ungraded': [dict(answer) for answer in self.season.ungraded_answers],
+            'scheduled_messages': {i: dict(j) for i, j in self.scheduled_messages.items()}
+        }
 
-        with open(f'{DATA_DIR}data/scheduled_messages.json', 'w') as file:
-            json.dump(self.scheduled_messages, file, indent=4)
+    def from_load(self, load):
+        self.season.from_load(load['problems'])
+        # a partial load leaves problems out, new ids still have to go past them
+        Problem.g_problem_id = max(Problem.g_problem_id, int(load.get('last_problem_id', 0)))
+        self.season.ungraded_answers = load['ungraded']
+        self.scheduled_messages = load['scheduled_messages']
+        self.scheduled_times = {i: to_epoch(j["time"]) for i, j in self.scheduled_messages.items()}
+        self.scheduled_heap = [(time, i) for i, time in self.scheduled_times.items()]
+        heapq.heapify(self.scheduled_heap)
+
+    def store_data(self, compact=False):
+        if compact: self.store.compact(self)
+        else: self.store.store(self)
 
     def load_data(self):
-        with open(f'{DATA_DIR}data/data.json', 'r') as file:
-            self.season.from_load(json.load(file))
-
-        with open(f'{DATA_DIR}data/ungraded.json', 'r') as file:
-            self.season.ungraded_answers = json.load(file)
-
-        with open(f'{DATA_DIR}data/scheduled_messages.json', 'r') as file:
-            self.scheduled_messages = json.load(file)
-
-    
-    
\ No newline at end of file
+        self.store.load(self)
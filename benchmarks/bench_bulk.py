@@ -0,0 +1,80 @@
+import time, asyncio
+from aiohttp import ClientSession
+from bench_util import report
+
+from discordHelper import discordHelper
+from fake_discord import fake_discord, fake_member, fake_role
+
+# send fan-out and role assignment against a local fake discord: one member at a time (before)
+# against discordHelper.bulk_run with the shared buckets, concurrency and retries (after)
+
+N_DMS = 100
+N_COHORT = 60
+
+async def legacy_send(members, content):
+    '''the loop send used to run, failures are reported and skipped'''
+    failed = []
+    for member in members:
+        try:
+            await member.send(content)
+        except Exception:
+            failed.append(member)
+    return failed
+
+async def legacy_add_role(role, members):
+    '''the loop add_members_to_role used to run'''
+    failed = []
+    for member in members:
+        try:
+            await member.add_roles(role)
+        except Exception:
+            failed.append(member)
+    return failed
+
+async def timed(coroutine):
+    start = time.perf_counter()
+    value = await coroutine
+    return time.perf_counter() - start, value
+
+def route_limits(server):
+    '''the helper's buckets sized from the fake server's route limits'''
+    return {"dm": server.limits["messages"], "roles": server.limits["roles"]}
+
+async def bench_send(server, base, session):
+    helper = discordHelper(None, None, route_limits(server))
+    members = [fake_member(base, session, member_id) for member_id in range(1, N_DMS + 1)]
+
+    before, failed = await timed(legacy_send(members, "hi"))
+    after, results = await timed(helper.bulk_run(members, lambda member: member.send("hi"), helper.dm_bucket))
+    report(f"send to {N_DMS} members", before, after)
+    print(f"{'':<40} failed before {len(failed)}, after {sum(result is not None for result in results.values())}")
+
+async def bench_roles(server, base, session):
+    helper = discordHelper(None, None, route_limits(server))
+    role = fake_role(1)
+    # a few already have the role, the bulk version skips them
+    before_cohort = [fake_member(base, session, member_id) for member_id in range(1, N_COHORT + 1)]
+    after_cohort = [fake_member(base, session, member_id) for member_id in range(1, N_COHORT + 1)]
+    for member in before_cohort[::10] + after_cohort[::10]: member.roles.append(role)
+
+    before, failed = await timed(legacy_add_role(role, before_cohort))
+    after, results = await timed(helper.add_members_to_role(role, after_cohort))
+    report(f"add role to {N_COHORT} members", before, after)
+    print(f"{'':<40} failed before {len(failed)}, after {sum(result is not None for result in results.values())}")
+
+    after, results = await timed(helper.remove_members_from_role(role, after_cohort))
+    print(f"{f'remove role from {N_COHORT} members':<40} after {after:12.6f}s   failed {sum(result is not None for result in results.values())}")
+
+async def main():
+    server = fake_discord()
+    base = await server.start()
+    try:
+        async with ClientSession() as session:
+            await bench_send(server, base, session)
+            await bench_roles(server, base, session)
+    finally:
+        await server.stop()
+    print(f"fake discord calls: {dict(server.calls)}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,151 @@
+import os, json, random, tempfile
+from bench_util import best_of, report
+
+import google_sheets.googleSheetsUpdater as gsu
+from google_sheets.googleSheetsUpdater import google_sheet_updater, pd
+from google_sheets.fake_gspread import FakeClient
+
+# display updates and season columns on a 1k member x 100 score column sheet, against the in-memory
+# fake gspread. the row by row code with a csv round trip and a full rewrite per push (before) against
+# the vectorized code with the frame cache and the snapshot diffs (after)
+
+N_MEMBERS = 1000
+N_COLUMNS = 100
+
+class fake_member:
+    def __init__(self, member_id):
+        self.id = member_id
+        self.display_name = f"member {member_id:04d}"
+
+class fake_index:
+    def __init__(self, members):
+        self.names = {str(member.id): member.display_name for member in members}
+        self.ids = {member.display_name: str(member.id) for member in members}
+
+    def names_copy(self):
+        return dict(self.names)
+
+    def ids_copy(self):
+        return dict(self.ids)
+
+class fake_helper:
+    '''the parts of discordHelper the sheets code reads'''
+    def __init__(self, members):
+        self.members = {member.id: member for member in members}
+        self.member_index = fake_index(members)
+
+    def index(self):
+        return self.member_index
+
+    def get_member(self, member_id):
+        return self.members[member_id]
+
+class fake_season:
+    def __init__(self, scores):
+        self.scores = scores
+        self.CURRENT_SEASON = 2
+
+    def get_grades(self, season):
+        return self.scores
+
+class fake_driver:
+    def __init__(self, scores):
+        self.season = fake_season(scores)
+
+class legacy_sheet_updater(google_sheet_updater):
+    '''the csv storage, update_display and add_potd_season the bot used to run'''
+    def get_ws(self, sheet_name, ws = True):
+        ws = self.worksheet(sheet_name) if ws else None
+        path = f"{gsu.DATA_DIR}gsdata/{sheet_name}.csv"
+        return ws, None if not os.path.exists(path) else pd.read_csv(path, dtype=str).fillna("").reset_index(drop=True)
+
+    def store_df(self, sheet_name, df):
+        df.astype(str).fillna("").reset_index(drop=True).to_csv(f"{gsu.DATA_DIR}gsdata/{sheet_name}.csv", index=False)
+
+    def update_display(self, sheet_name):
+        ws, df = self.get_ws(sheet_name)
+        if ws is None: ws = self.SHEET.add_worksheet(sheet_name, len(self.data["names"]) + 1, 2)
+        if df is None: df = pd.DataFrame(columns=["Name"], dtype=str)
+
+        for name in self.data["names"]:
+            if name not in df["Name"].values:
+                df = pd.concat([df, pd.DataFrame({"Name": [name]})], ignore_index=True)
+        df = df.reset_index(drop=True)
+
+        df_names = df[df["Name"].isin(self.data["names"])].fillna("").reset_index(drop=True)
+
+        for i in range(len(df_names["Name"])):
+            try:
+                member = self.helper.get_member(int(df_names.loc[i, "Name"]))
+                df_names.loc[i, "Name"] = member.display_name
+            except:
+                continue
+
+        df_names = df_names.sort_values(by=["Name"]).reset_index(drop=True)
+
+        ws.resize(cols=len(df_names.columns), rows=len(df_names.index) + 1)
+        ws.update(values=[df_names.columns.values.tolist()] + df_names.values.tolist(), range_name=None, value_input_option='USER_ENTERED')
+
+        self.store_df(sheet_name, df)
+
+    def add_potd_season(self, driver, helper, sheet_name, season = "None", date = "None"):
+        ws, df = self.get_ws(sheet_name)
+        if df is None: return None
+
+        self.add_column(sheet_name, f"{season}: {date}", False)
+
+        scores = driver.season.get_grades(season)
+        for i in range(len(df["Name"])):
+            score = scores[df.loc[i, "Name"]] if df.loc[i, "Name"] in scores else "0"
+            df.loc[i, f"{season}: {date}"] = str(score)
+
+        self.store_df(sheet_name, df)
+
+        self.update_display(sheet_name)
+
+def sheet_frame(rng, names):
+    columns = {"Name": names}
+    for i in range(N_COLUMNS):
+        date = (pd.Timestamp("2024-01-01") + pd.Timedelta(weeks=i)).strftime("%m/%d/%Y")
+        columns[f"{i + 1}: {date}"] = [rng.randint(0, 7) for _ in names]
+    return pd.DataFrame(columns)
+
+def calls(client, func):
+    client.calls.clear()
+    func()
+    return dict(client.calls)
+
+def main():
+    rng = random.Random(0)
+    members = [fake_member(member_id) for member_id in range(1, N_MEMBERS + 1)]
+    helper = fake_helper(members)
+    names = [str(member.id) for member in members]
+
+    gsu.DATA_DIR = tempfile.mkdtemp() + "/"
+    os.makedirs(f"{gsu.DATA_DIR}gsdata/")
+    with open(f"{gsu.DATA_DIR}gsdata/data.json", "w") as file:
+        json.dump({"names": names}, file)
+
+    df = sheet_frame(rng, names)
+    legacy = legacy_sheet_updater(helper, client=FakeClient())
+    legacy.store_df("legacy", df)
+    current = google_sheet_updater(helper, client=FakeClient())
+    current.store_df("current", df)
+
+    # the first push writes every cell either way, the ones after it only write what changed
+    print(f"{'update_display, first push':<40} before calls {calls(legacy.client, lambda: legacy.update_display('legacy'))}")
+    print(f"{'':<40} after calls  {calls(current.client, lambda: current.update_display('current'))}")
+    before = best_of(lambda: legacy.update_display("legacy"))
+    after = best_of(lambda: current.update_display("current"))
+    report(f"update_display ({N_MEMBERS}x{N_COLUMNS})", before, after)
+    print(f"{'':<40} before calls {calls(legacy.client, lambda: legacy.update_display('legacy'))}")
+    print(f"{'':<40} after calls  {calls(current.client, lambda: current.update_display('current'))}")
+
+    scores = {name: rng.randint(0, 7) for name in names[::2]}
+    driver = fake_driver(scores)
+    before = best_of(lambda: legacy.add_potd_season(driver, helper, "legacy", "101", "01/01/2026"))
+    after = best_of(lambda: current.add_potd_season(driver, helper, "current", "101", "01/01/2026"))
+    report(f"add_potd_season ({N_MEMBERS}x{N_COLUMNS})", before, after)
+
+if __name__ == "__main__":
+    main()
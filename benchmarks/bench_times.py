@@ -0,0 +1,53 @@
+import random, tempfile
+from bench_util import best_of, report
+
+from POTDfunctionality import *
+from storage.journal import JournalStore
+
+# per-check cost of "is this problem open" and "which scheduled messages are due" with 10k of each,
+# parsing the time strings on every check (before) against the pre-parsed epoch seconds (after)
+
+N = 10000
+
+def legacy_in_interval(problem):
+    return pd.Timestamp(problem.start_time, tz=timezone) <= pd.Timestamp.now(tz=timezone) and \
+           pd.Timestamp(problem.end_time, tz=timezone) >= pd.Timestamp.now(tz=timezone)
+
+def legacy_due(scheduled_messages):
+    return [(i, j) for i, j in scheduled_messages.items() if pd.Timestamp(j["time"], tz=timezone) <= pd.Timestamp.now(tz=timezone)]
+
+def random_time(rng, base):
+    return (base + pd.Timedelta(minutes=rng.randint(-60 * 24 * 30, 60 * 24 * 30))).strftime("%Y-%m-%d %H:%M")
+
+def main():
+    rng = random.Random(0)
+    # fixed and a month away from either dst change, so the legacy parse never hits an ambiguous time
+    base = pd.Timestamp("2025-06-15 12:00")
+
+    problems = []
+    for i in range(N):
+        start, end = sorted([random_time(rng, base), random_time(rng, base)])
+        problems.append(Problem("", "", start, end, "1", i + 1))
+
+    # journaled to a throwaway directory
+    driver = Driver(JournalStore(tempfile.mkdtemp() + "/"))
+    for i in range(N):
+        driver.set_scheduled_message(str(i), {"time": random_time(rng, base), "text": "", "channel": "0", "filename": None})
+
+    before = best_of(lambda: [legacy_in_interval(problem) for problem in problems])
+    def after_interval():
+        now = now_epoch()
+        return [problem.in_interval(now) for problem in problems]
+    after = best_of(after_interval)
+    report(f"in_interval, per problem ({N})", before, after, unit=N / 1e6, suffix="us")
+
+    # a tick used to parse every message, now it only looks at the top of the heap
+    before = best_of(lambda: legacy_due(driver.scheduled_messages))
+    def after_tick():
+        next_time = driver.next_scheduled_time()
+        return next_time is not None and next_time <= now_epoch()
+    after = best_of(after_tick)
+    report(f"scheduled message tick ({N} messages)", before, after, unit=1e-3, suffix="ms")
+
+if __name__ == "__main__":
+    main()
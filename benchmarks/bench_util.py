@@ -0,0 +1,35 @@
+import os, sys, time
+
+# shared timing helpers for the standalone benchmark scripts in this directory
+#
+#   python benchmarks/bench_times.py
+#
+# every script puts the repository root on sys.path, so it runs from anywhere
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path: sys.path.insert(0, ROOT_DIR)
+
+def best_of(func, repeat=3):
+    '''fastest of repeat runs of func(), in seconds'''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+async def best_of_async(func, repeat=3):
+    '''fastest of repeat runs of await func(), in seconds'''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def report(name, before, after, unit=1.0, suffix="s"):
+    '''prints one before/after line, times are divided by unit (e.g. the number of items for a per-item cost)'''
+    speedup = before / after if after > 0 else float("inf")
+    print(f"{name:<40} before {before / unit:12.6f}{suffix}   after {after / unit:12.6f}{suffix}   {speedup:8.1f}x")
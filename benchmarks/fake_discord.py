@@ -0,0 +1,108 @@
+import time, random, asyncio
+from collections import Counter, deque
+from aiohttp import web
+
+# local stand-in for the discord http routes the bulk operations hit, with discord style rate limits
+#
+#   server = fake_discord()
+#   base = await server.start()
+#   async with ClientSession() as session:
+#       member = fake_member(base, session, 1)
+#       await member.send("hi")
+#   server.calls  ->  Counter({'messages': 1})
+#
+# every route answers after latency seconds. past its (limit, window) a route answers 429 with a
+# retry_after, and error_rate of the accepted requests fail with a 500
+
+class FakeHTTPException(Exception):
+    '''what a failed request raises, shaped like discord.HTTPException'''
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"{status} from fake discord")
+        self.status = status
+        self.retry_after = retry_after
+
+class fake_discord:
+    def __init__(self, latency=0.2, error_rate=0.02, limits=None, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        # route -> (requests, per seconds)
+        self.limits = limits or {"messages": (50, 1.0), "roles": (10, 1.0)}
+        self.hits = {route: deque() for route in self.limits}
+        self.rng = random.Random(seed)
+        self.calls = Counter()
+        self.runner = None
+
+    async def handle(self, route):
+        await asyncio.sleep(self.latency)
+
+        now = time.monotonic()
+        limit, window = self.limits[route]
+        hits = self.hits[route]
+        while hits and hits[0] <= now - window: hits.popleft()
+        if len(hits) >= limit:
+            self.calls["429"] += 1
+            retry_after = hits[0] + window - now
+            return web.json_response({"message": "You are being rate limited.", "retry_after": retry_after, "global": False}, status=429, headers={"Retry-After": f"{retry_after:.3f}"})
+        hits.append(now)
+
+        if self.rng.random() < self.error_rate:
+            self.calls["500"] += 1
+            return web.json_response({"message": "500: Internal Server Error"}, status=500)
+        self.calls[route] += 1
+        return web.json_response({}) if route == "messages" else web.Response(status=204)
+
+    async def handle_messages(self, request):
+        return await self.handle("messages")
+
+    async def handle_roles(self, request):
+        return await self.handle("roles")
+
+    async def start(self):
+        '''serves on a free local port, returns the base url'''
+        app = web.Application()
+        app.router.add_post("/channels/{channel_id}/messages", self.handle_messages)
+        app.router.add_put("/guilds/{guild_id}/members/{member_id}/roles/{role_id}", self.handle_roles)
+        app.router.add_delete("/guilds/{guild_id}/members/{member_id}/roles/{role_id}", self.handle_roles)
+
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self.runner.addresses[0][:2]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+class fake_role:
+    def __init__(self, role_id):
+        self.id = role_id
+
+class fake_member:
+    '''the parts of discord.Member that send and the role commands use'''
+    def __init__(self, base, session, member_id, guild_id=1):
+        self.base = base
+        self.session = session
+        self.id = member_id
+        self.guild_id = guild_id
+        self.mention = f"<@{member_id}>"
+        self.display_name = f"member {member_id}"
+        self.roles = []
+
+    async def request(self, method, path, **kwargs):
+        async with self.session.request(method, self.base + path, **kwargs) as response:
+            if response.status >= 400:
+                body = await response.json()
+                raise FakeHTTPException(response.status, body.get("retry_after"))
+
+    async def send(self, content):
+        # the dm channel of a member is addressed by the member id here
+        await self.request("POST", f"/channels/{self.id}/messages", json={"content": content})
+
+    async def add_roles(self, role):
+        await self.request("PUT", f"/guilds/{self.guild_id}/members/{self.id}/roles/{role.id}")
+        self.roles.append(role)
+
+    async def remove_roles(self, role):
+        await self.request("DELETE", f"/guilds/{self.guild_id}/members/{self.id}/roles/{role.id}")
+        self.roles.remove(role)
@@ -6,7 +6,11 @@ TOKEN = os.getenv("TOKEN")
 # arml specific functionality
 from POTDfunctionality import *
 from google_sheets.googleSheetsUpdater import google_sheet_updater
+from google_sheets.async_sheets import async_sheets
+from google_sheets.jobs import job_queue
 from user_data.user_data import user_data
+from reaction_tracker.reaction_tracker import reaction_tracker
+from storage.persistence import PersistenceScheduler
 
 # python functionality
 from textwrap import dedent
@@ -32,9 +36,16 @@ def check_float(x):
 MAX_ROW_PUBLIC_LEADERBOARD = 20
 my_userid = 568622241902886934
 
-potd_driver, helper, gs_helper, ud = None, None, None, None
+potd_driver, helper, gs_helper, ud, jobs, tracker = None, None, None, None, None, None
+
+# blocking google sheets work runs through these so it doesn't stall the gateway
+gs_sheets, ud_sheets = async_sheets(), async_sheets()
 
 potd_driver = Driver()
+persistence = PersistenceScheduler(on_error=log_error)
+# set whenever the schedule changes so check_scheduled_messages recomputes its sleep
+scheduled_wakeup = asyncio.Event()
+scheduled_task = None
 
 ##################################################################################
 # SECURITY & STORAGE
@@ -120,30 +131,24 @@ def wrapper_funcs(func):
 # USER DATA
 
 def map_names(df, column_name):
-    id_to_name = {str(user.id): user.display_name for user in helper.guild().members}
+    id_to_name = helper.index().names
     df[column_name] = df[column_name].map(lambda x: id_to_name.get(x, x))
 
 def get_ud_data():
     '''
-    Retrieves the user data for the current season in a DF
+    Retrieves the user data for the current season in a DF, with a Competitor_ column and a row for
+    every year_role member. this is the frame user_data keeps, so don't change it in place
     ''' 
-    df = ud.data_as_df()
-    df = pd.DataFrame({key: df.get(key, '-') for key in ud.keys})
-
-    # add year_role users if not alr in by comparing useR_ids 
-    users_to_add = [str(user.id) for user in helper.get_users([constants["year_role"]]) if str(user.id) not in df.index]
-    df = pd.concat([df, pd.DataFrame(index=users_to_add, columns=df.columns).fillna("-")], axis=0) 
+    return ud.frame
 
-    # add _Competitor column mapping user ids --> id_to_role[user.id]
-    id_to_role = {str(user.id): (1 if any(constants["year_role"] == role.id for role in user.roles) else 0) for user in helper.guild().members}
-    df["Competitor_"] = df.index.map(lambda x : id_to_role.get(x, x))
-    df = df[['Competitor_'] + ud.get_keys()]
+def sync_ud_members():
+    index = helper.index()
+    ud.set_members(index.names.keys(), index.with_roles([constants["year_role"]]))
 
-    # # make display_names
-    # member_ids = [member.id for member in helper.guild().members]
-    # df.index = [helper.guild().get_member(int(index)).display_name for index in df.index if int(index) in member_ids]
-
-    return df
+def sync_ud_member(member_id):
+    index = helper.index()
+    member_id = str(member_id)
+    ud.update_member(member_id, member_id in index.names, constants["year_role"] in index.member_roles.get(member_id, ()))
 
 @chain(client.command(), wrapper_funcs)
 async def ud_mydata(ctx: commands.Context) -> None:
@@ -154,15 +159,13 @@ async def ud_mydata(ctx: commands.Context) -> None:
 
     @returns: None
     '''
-    df = get_ud_data()
+    # get member & create if not already in the data
+    ud.create_user(str(ctx.author.id))
 
-    # get member & create if not already in DF
-    if str(ctx.author.id) not in df.index:
-        ud.create_user(str(ctx.author.id))
-        df.loc[str(ctx.author.id)] = '-'
-
-    # transpose 
-    df = df.T.loc[~df.columns.str.endswith('_'), [str(ctx.author.id)]].rename(columns={str(ctx.author.id): ctx.author.display_name})
+    # one column of the user's own (non-admin) keys
+    values = ud.get_user(ctx.author.id)
+    keys = [key for key in ud.get_keys() if not key.endswith('_')]
+    df = pd.DataFrame({ctx.author.display_name: [values[key] for key in keys]}, index=keys)
 
     await ctx.send(f"```{df.to_string(index=True)}```")
 
@@ -181,8 +184,9 @@ async def ud_update_gs(ctx: commands.Context) -> None:
 
     map_names(df, "Name")
 
-    if ud.post_df(df): 
-        await ctx.send(f"Data updated successfully.")
+    cells = await ud_sheets.run(ud.post_df, df)
+    if cells is not None: 
+        await ctx.send(f"Data updated successfully ({cells} cells written).")
         return 
     
     await ctx.send(f"Data failed to update.")
@@ -196,24 +200,29 @@ async def gs_update_ud(ctx: commands.Context) -> None:
 
     @returns: None
     '''
-    gs_df = ud.get_df()
-    users = helper.guild().members
-    display_to_id = {user.display_name: str(user.id) for user in users}
+    gs_df = await ud_sheets.run(ud.get_df)
+    display_to_id = helper.index().ids
     key_order = gs_df.columns.tolist()
     key_order.remove("Competitor_")
     key_order.remove("Name")
-    ud.update_key_order(key_order)
-    
-    for _, row in gs_df.iterrows():
-        id = display_to_id[row['Name']]
-        for key, val in row.items():
-            if key=="Name": continue
-            if val=='-' or val=="":
-                if id in ud.data and key in ud.data[id]: del ud.data[id][key]
-                continue
-            ud.set_user_data(id, key, val)
-    ud.store_data()
-    await ctx.send("Data stored successfully.")
+
+    # rows are named by display name, or by id for people no longer in the server
+    ids = gs_df["Name"].map(lambda name: display_to_id.get(name, name if name in ud.data else None))
+    unknown = gs_df.loc[ids.isna(), "Name"].tolist()
+    sheet = gs_df[ids.notna()].set_index(ids[ids.notna()])[key_order].replace("", "-")
+
+    with ud.batch():
+        ud.update_key_order(key_order)
+        ud.create_users(sheet.index)
+
+        # only the cells that differ from what is stored, '-' clears the key
+        current = ud.frame.reindex(index=sheet.index, columns=key_order, fill_value="-")
+        rows, cols = np.nonzero(sheet.ne(current).values)
+        changed = zip(sheet.index[rows], sheet.columns[cols], sheet.values[rows, cols])
+        updated = ud.set_many((user_id, key, None if val == '-' else val) for user_id, key, val in changed)
+
+    await ctx.send(f"Data stored successfully ({updated} values changed).")
+    if unknown: await ctx.send(f"Skipped unknown names: {', '.join(unknown)}.")
 
 @chain(client.command(), wrapper_funcs)
 async def ud_update_mydata(ctx: commands.Context, key: str, value: str) -> None:
@@ -324,19 +333,13 @@ async def check_bdays() -> None:
 
     @returns: None
     '''
-    df = get_ud_data().loc[:, ["Date of Birth_"]] 
-    df = df[df["Date of Birth_"] != "-"]
-    df["Date of Birth_"] = df["Date of Birth_"].map(lambda x: "/".join(x.split("/")[:2]))
-
-    df = df[df["Date of Birth_"] == f"{datetime.datetime.now().month}/{datetime.datetime.now().day}"]
-    id_to_mention = {str(user.id): user.mention for user in helper.guild().members}
-    df.index = df.index.map(lambda x: id_to_mention.get(x, "-1"))
-    df = df[df.index != "-1"]
-    
-    if len(df.index) == 0: return
+    today = datetime.datetime.now()
+    id_to_mention = helper.index().mentions
+    df_index = [id_to_mention[user_id] for user_id in ud.birthdays_on(today.month, today.day) if user_id in id_to_mention]
+
+    if len(df_index) == 0: return
 
     channel = client.get_channel(int(1222873409923580009))
-    df_index = list(df.index)
     if len(df_index) == 1:
         await channel.send(f"Happy Birthday to {df_index[0]}!")
     elif len(df_index) == 2:
@@ -347,6 +350,28 @@ async def check_bdays() -> None:
 
     return 
 
+@chain(client.command(), commands.check(is_administrator), wrapper_funcs)
+async def upcoming_bdays(ctx: commands.Context, n: int = 5) -> None:
+    '''
+    [Admin only] Lists the next birthdays, starting today.
+
+    @param ctx (commands.Context): The context object representing the invocation context.
+    @param n (int): How many birthdays to list.
+
+    @returns: None
+    '''
+    n = max(int(n), 0)
+    id_to_name = helper.index().names
+
+    # birthdays of people who left the server are skipped, ask for more only while that leaves the list short
+    wanted = n
+    while True:
+        found = ud.upcoming_birthdays(wanted)
+        upcoming = [f"{month}/{day}: {id_to_name[user_id]}" for month, day, user_id in found if user_id in id_to_name][:n]
+        if len(upcoming) == n or len(found) < wanted: break
+        wanted *= 2
+    await ctx.send("```" + "\n".join(upcoming) + "```" if upcoming else "No birthdays on record.")
+
 @check_bdays.before_loop
 async def before_check_bdays():
     current_time = datetime.datetime.now()
@@ -867,6 +892,7 @@ async def schedule(ctx, channel, text, time):
             "channel": channel[2:-1]
         })
         image_filename = await helper.save_image_from_text(ctx)
+    scheduled_wakeup.set()
     
     await ctx.send(f"Message scheduled at {time}")
 
@@ -899,18 +925,24 @@ async def remsched(ctx, smesid):
     @returns None'''
     
     if str(smesid) in potd_driver.scheduled_messages:
-        x = potd_driver.scheduled_messages.pop(str(smesid))
+        x = potd_driver.remove_scheduled_message(str(smesid))
         if x["filename"]: os.remove(f"{DATA_DIR}images/{x['filename']}")
+        scheduled_wakeup.set()
         await ctx.send("Successfully removed scheduled message.")
     else:
         await ctx.send("Could not find scheduled message")
 
-@tasks.loop(minutes=1)
-async def check_scheduled_messages():
-    '''sends scheduled messages on time'''
+async def send_scheduled_messages():
+    '''sends every scheduled message that is due'''
     global constants
-    scheduled_messages = [(i, j) for i, j in potd_driver.scheduled_messages.items() if pd.Timestamp(j["time"], tz=timezone) <= pd.Timestamp.now(tz=timezone)]
-    for i, j in scheduled_messages:
+    # one off the heap at a time, so whatever is still due stays on it if this stops partway
+    now = now_epoch()
+    sent = False
+    while True:
+        due = potd_driver.pop_due_scheduled_message(now)
+        if due is None: break
+        i, j = due
+        sent = True
         print(i, j)
         try:
             if not j["text"]: j["text"] = ""
@@ -919,36 +951,39 @@ async def check_scheduled_messages():
             await channel.send(content=j["text"], file=file)
             if j['filename']: os.remove(f"{DATA_DIR}images/{j['filename']}")
         except Exception as e:
-            channel = helper.get_channel(constants["admin_channel"])
-            await channel.send(f"Error sending scheduled message.")
-            raise Exception(e)
-        potd_driver.scheduled_messages.pop(i)
-    store_data()
+            log_error(f"Error sending scheduled message {i} -- {e}")
+            if potd_driver.retry_scheduled_message(i, 60): continue
+
+            # out of retries, drop it and say so once
+            potd_driver.remove_scheduled_message(i)
+            try:
+                channel = helper.get_channel(constants["admin_channel"])
+                await channel.send(f"Error sending scheduled message {i}, dropped it after repeated failures: {e}")
+            except Exception as alert_error:
+                log_error(alert_error)
+            continue
+        potd_driver.remove_scheduled_message(i)
+    if sent: store_data()
 
-@chain(client.command(), commands.check(is_me), wrapper_funcs)
-async def start_sched(ctx):
-    global constants
-    scheduled_messages = [(i, j) for i, j in potd_driver.scheduled_messages.items() if pd.Timestamp(j["time"], tz=timezone) <= pd.Timestamp.now(tz=timezone)]
-    for i, j in scheduled_messages:
-        print(i, j)
+async def check_scheduled_messages():
+    '''sends scheduled messages on time, sleeping until the next one is due or the schedule changes'''
+    while True:
+        scheduled_wakeup.clear()
+        next_time = potd_driver.next_scheduled_time()
+        timeout = None if next_time is None else max(0.01, next_time - time.time())
         try:
-            if not j["text"]: j["text"] = ""
-            channel = client.get_guild(constants["server_id"]).get_channel(int(j["channel"]))
-            file = discord.File(f"{DATA_DIR}images/{j['filename']}") if j["filename"] else None
-            await channel.send(content=j["text"], file=file)
-            if j['filename']: os.remove(f"{DATA_DIR}images/{j['filename']}")
+            await asyncio.wait_for(scheduled_wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        try:
+            await send_scheduled_messages()
         except Exception as e:
-            channel = helper.get_channel(constants["admin_channel"])
-            await channel.send(f"Error sending scheduled message.")
-            raise Exception(e)
-        potd_driver.scheduled_messages.pop(i)
+            log_error(e)
+
+@chain(client.command(), commands.check(is_me), wrapper_funcs)
+async def start_sched(ctx):
+    await send_scheduled_messages()
     store_data()
-    
-@check_scheduled_messages.before_loop
-async def before_check_scheduled_messages():
-    current_time = datetime.datetime.now()
-    seconds_until_next_interval = 60 - current_time.second
-    await asyncio.sleep(seconds_until_next_interval)
 
 ##################################################################################
 # STATISTICS & COMMUNICATION
@@ -968,35 +1003,84 @@ async def reactstats(ctx, post_id, role_needed = None):
     role_needed = helper.parse_role(role_needed).id if role_needed is not None else constants["year_role"]
     
     try:
-        post = await helper.get_post(post_id)
+        census = await tracker.reaction_census(post_id)
     except Exception as e:
         await ctx.send(f"Could not find post with id {post_id}.")
         print(e)
         return
 
-    user_list = {user.display_name:user for user in post.guild.members if not user.bot and any(role.id == role_needed for role in user.roles)}
+    members = [user for user in helper.get_users([role_needed]) if not user.bot]
+    member_ids = {str(user.id) for user in members}
+    mentions = helper.index().mentions
 
-    reacting_users = {}
-    for reaction in post.reactions:
-        list = [user.mention async for user in reaction.users() if user.display_name in user_list]
-        await ctx.send(f"**{reaction.emoji}**: {', '.join(list)}", silent=True)
-        async for user in reaction.users():
-            if user.display_name not in reacting_users: reacting_users[user] = [reaction.emoji] 
-            else: reacting_users[user].append(reaction.emoji)
+    for emoji in census.emojis:
+        list = [mentions.get(user_id, f"<@{user_id}>") for user_id in census.reactors[emoji] if user_id in member_ids]
+        await ctx.send(f"**{emoji}**: {', '.join(list)}", silent=True)
 
-    users_list = [user.mention for user in user_list.values() if user not in reacting_users]
+    users_list = [user.mention for user in members if str(user.id) not in census.user_emojis]
     await ctx.send(f"**No reaction**: {', '.join(users_list) if len(users_list) > 0 else 'None'}", silent=True)
 
     message = "More than one reaction:\n"
-    for user, emojis in reacting_users.items():
-        if len(emojis) > 1:
-            if not any(role.id == role_needed for role in user.roles): continue
-            message += f"**{user.mention}**: {', '.join(emojis)}\n"
+    for user_id, emojis in census.user_emojis.items():
+        if len(emojis) > 1 and user_id in member_ids:
+            message += f"**{mentions.get(user_id, f'<@{user_id}>')}**: {', '.join(emojis)}\n"
 
     await ctx.send(message, silent=True)
 
     return 
 
+@chain(client.command(), commands.check(is_administrator), wrapper_funcs)
+async def track_post(ctx, post_id):
+    '''
+    [Admin only] Starts keeping the reactions of a post up to date locally, so reactstats and send on it need no fetching.
+
+    @param ctx (commands.Context): The context of the command.
+    @param post_id (int): The ID of the post to track.
+
+    @returns: None
+    '''
+    post_id = helper.parse_type(int, post_id)
+    try:
+        await tracker.track(post_id)
+    except Exception as e:
+        await ctx.send(f"Could not find post with id {post_id}.")
+        print(e)
+        return
+    await ctx.send(f"Tracking reactions on post {post_id}.")
+
+@chain(client.command(), commands.check(is_administrator), wrapper_funcs)
+async def untrack_post(ctx, post_id):
+    '''
+    [Admin only] Stops tracking the reactions of a post.
+
+    @param ctx (commands.Context): The context of the command.
+    @param post_id (int): The ID of the post to stop tracking.
+
+    @returns: None
+    '''
+    post_id = helper.parse_type(int, post_id)
+    if tracker.untrack(post_id): await ctx.send(f"Stopped tracking reactions on post {post_id}.")
+    else: await ctx.send(f"Post {post_id} is not tracked.")
+
+def compile_template(message):
+    '''
+    Splits a message into literal text and {expression} placeholders, compiling each expression once.
+
+    @param message (str): The message, `ping` is replaced by the user's mention.
+
+    @return (list): The leading text followed by (code, text) pairs.
+    '''
+    parts = message.split("{")
+    template = [parts[0]]
+    for part in parts[1:]:
+        expression, text = part.split("}", 1)
+        template.append((compile(expression, "<send>", "eval"), text))
+    return template
+def render_template(template, user, ctx):
+    '''Evaluates a compiled template for one user.'''
+    message = template[0] + "".join(str(eval(code, globals(), {"user": user, "ctx": ctx})) + text for code, text in template[1:])
+    return message.replace("`ping`", user.mention)
+
 @chain(client.command(), commands.check(is_me), wrapper_funcs)
 async def send(ctx, message, roles_to_match = "None", roles_to_exclude = "None", user_ids_to_match = "None", user_ids_to_exclude = "None", post_id = "None"):
     '''
@@ -1024,32 +1108,26 @@ async def send(ctx, message, roles_to_match = "None", roles_to_exclude = "None",
     post_id = helper.parse_type(int, post_id) if post_id != "None" else None
 
     users = helper.get_users(roles_to_match, roles_to_exclude, user_ids_to_match, user_ids_to_exclude)
+    template = compile_template(message)
     if post_id != None:
         try:
-            post = await helper.get_post(post_id)
+            census = await tracker.reaction_census(post_id)
         except Exception as e:
             await ctx.send(f"Could not find post with id {post_id}.")
             print(e)
             return
 
-        reacting_users = set()
-        for reaction in post.reactions:
-            async for user in reaction.users():
-                reacting_users.add(user)
-        users = [user for user in users if user not in reacting_users]
+        users = [user for user in users if str(user.id) not in census.user_emojis]
 
-    for user in users:
-        try:
-            customized_message = message.replace("`ping`", user.mention)
-            customized_message = customized_message.split("{")
-            for i in range(1, len(customized_message)):
-                customized_message[i] = str(eval(customized_message[i].split("}")[0])) + customized_message[i].split("}")[1]
-            customized_message = "".join(customized_message)
-            await user.send(customized_message)
-        except:
-            ctx.send(f"Failed to send to {user.display_name}.")
-
-    await ctx.send(f"Message sent to {[user.display_name for user in users]}.")
+    async def send_to(user):
+        await user.send(render_template(template, user, ctx))
+    results = await helper.bulk_run(users, send_to, helper.dm_bucket)
+
+    sent = [user for user in users if results[user] is None]
+    failed = [user for user in users if results[user] is not None]
+    await ctx.send(f"Message sent to {[user.display_name for user in sent]}.")
+    for user in failed:
+        await ctx.send(f"Failed to send to {user.display_name}: {results[user]}")
     await ctx.send(f"Message not sent to {[user.display_name for user in guild.members if user not in users and not user.bot]}.")
 
     return 
@@ -1069,9 +1147,58 @@ async def mod_role(ctx, role_name, members):
 
     users = helper.parse_users(members)
 
-    await helper.add_members_to_role(role_name, users)
+    results = await helper.add_members_to_role(role_name, users, role_progress(await ctx.send("Assigning role...", silent=True), "Assigned"))
+    await send_role_report(ctx, users, results, "assigned to")
+
+@chain(client.command(), commands.check(is_me), wrapper_funcs)
+async def unmod_role(ctx, role_name, members):
+    '''
+    Removes a role from the specified members.
+
+    @param ctx (commands.Context): The context of the command.
+    @param role_name (str): The role to remove, @role
+    @param members (list of @s, separated by spaces, in quotes): The list of members to remove the role from.
+
+    @returns: None
+    '''
+    role_name = helper.parse_role(role_name)
+
+    users = helper.parse_users(members)
+
+    results = await helper.remove_members_from_role(role_name, users, role_progress(await ctx.send("Removing role...", silent=True), "Removed"))
+    await send_role_report(ctx, users, results, "removed from")
 
-    await ctx.send(f"Role assigned to {', '.join([user.mention for user in users])}.")
+def role_progress(message, verb):
+    '''
+    Returns a progress callback for bulk role operations that edits message every 10 members.
+
+    @param message (discord.Message): The message to edit.
+    @param verb (str): What is being done, e.g. "Assigned".
+
+    @return (function): The callback.
+    '''
+    async def on_progress(done, total):
+        if done % 10 == 0 or done == total:
+            await message.edit(content=f"{verb} {done}/{total}.")
+    return on_progress
+
+async def send_role_report(ctx, users, results, verb):
+    '''
+    Reports which members a bulk role operation succeeded, skipped, or failed for.
+
+    @param ctx (commands.Context): The context of the command.
+    @param users (list): The members the operation was requested for.
+    @param results (dict): The results of the operation, member -> None or exception.
+    @param verb (str): What happened to the role, e.g. "assigned to".
+
+    @returns: None
+    '''
+    done = [user.mention for user in users if user in results and results[user] is None]
+    skipped = [user.mention for user in users if user not in results]
+    failed = [f"{user.mention} ({results[user]})" for user in users if user in results and results[user] is not None]
+    await ctx.send(f"Role {verb} {', '.join(done) if done else 'no one'}.")
+    if skipped: await ctx.send(f"Skipped (nothing to do): {', '.join(skipped)}.")
+    if failed: await ctx.send(f"Failed: {', '.join(failed)}.")
 
 ##################################################################################
 # GOOGLE SHEETS COMMANDS
@@ -1085,8 +1212,7 @@ async def gs_update_role(ctx: commands.Context, role: str) -> None:
 
     @returns: None
     '''
-    gs_helper.update_people([str(user.id) for user in helper.get_users([int(role[3:-1])])])
-    await ctx.send(f"Updated sheet's people to all with role.")
+    await submit_job(ctx, "update role", "update_people", [None], [[str(user.id) for user in helper.get_users([int(role[3:-1])])]])
 
 @chain(client.command(), commands.check(is_me), wrapper_funcs)
 async def gs_update_people(ctx: commands.Context, people: str) -> None:
@@ -1097,8 +1223,7 @@ async def gs_update_people(ctx: commands.Context, people: str) -> None:
 
     @returns: None
     '''
-    gs_helper.update_people([user[2:-1] for user in people.split(' ')])
-    await ctx.send(f"Updated sheet's people.")
+    await submit_job(ctx, "update people", "update_people", [None], [[user[2:-1] for user in people.split(' ')]])
 
 # gs_create_sheet(sheet_name)
 @chain(client.command(), commands.check(is_me), wrapper_funcs)
@@ -1110,7 +1235,7 @@ async def gs_create_sheet(ctx: commands.Context, sheet_name: str) -> None:
 
     @returns: None
     '''
-    gs_helper.update_display(sheet_name)
+    await gs_sheets.run(gs_helper.update_display, sheet_name, sheet=sheet_name)
     await ctx.send(f"Created sheet '{sheet_name}'.")
 
 # gs_create_test_sheet(sheet_name, num_problems)
@@ -1124,9 +1249,27 @@ async def gs_create_test_sheet(ctx: commands.Context, sheet_name: str, num_probl
 
     @returns: None
     '''
-    gs_helper.create_test_sheet(sheet_name, int(num_problems))
+    _, skipped = await gs_sheets.run(gs_helper.create_test_sheet, sheet_name, int(num_problems), sheet=sheet_name)
+    if skipped:
+        await ctx.send(f"Sheet '{sheet_name}' already exists, nothing was written.")
+        return
     await ctx.send(f"Created test sheet '{sheet_name}' with {num_problems} problems.")
 
+# gs_create_test_sheets(num_problems, *sheet_names)
+@chain(client.command(), commands.check(is_me), wrapper_funcs)
+async def gs_create_test_sheets(ctx: commands.Context, num_problems: int, *sheet_names) -> None:
+    '''[Admin only] Creates several test sheets with the same number of problems at once.
+
+    @param ctx (commands.Context): The context of the command.
+    @param num_problems (int): The number of problems on each sheet.
+    @param *sheet_names (list): The names of the sheets to create.
+
+    @returns: None
+    '''
+    cells, skipped = await gs_sheets.run(gs_helper.create_test_sheets, [(sheet_name, int(num_problems)) for sheet_name in sheet_names])
+    await ctx.send(f"Created {len(sheet_names) - len(skipped)} test sheets with {num_problems} problems ({cells} cells written).")
+    if skipped: await ctx.send(f"Already exist, left unchanged: {', '.join(skipped)}")
+
 # gs_add_column(sheet_name, column_name, *args) where *args is list of values 
 @chain(client.command(), commands.check(is_me), wrapper_funcs)
 async def gs_add_column(ctx: commands.Context, sheet_name: str, column_name: str) -> None:
@@ -1138,7 +1281,7 @@ async def gs_add_column(ctx: commands.Context, sheet_name: str, column_name: str
 
     @returns: None
     '''
-    gs_helper.add_column(sheet_name, column_name) 
+    await gs_sheets.run(gs_helper.add_column, sheet_name, column_name, sheet=sheet_name)
     await ctx.send(f"Added column '{column_name}' to sheet '{sheet_name}'.")
 
 # gs_add_potd_season()
@@ -1153,8 +1296,7 @@ async def gs_add_potd_season(ctx: commands.Context, date: str = "None", season_i
     @returns: None
     '''
     if season_id == "None": season_id = str(potd_driver.season.CURRENT_SEASON - 1)
-    gs_helper.add_potd_season(potd_driver, helper, sheet_name, season_id, date)
-    await ctx.send(f"Added season {season_id} to sheet '{sheet_name}'.")
+    await submit_job(ctx, f"add season {season_id}", "add_potd_season", [sheet_name], [season_id, date])
 
 # gs_del_sheet
 @chain(client.command(), commands.check(is_me), wrapper_funcs)
@@ -1166,7 +1308,7 @@ async def gs_del_sheet(ctx: commands.Context, sheet_name: str) -> None:
 
     @returns: None
     '''
-    gs_helper.del_ws(sheet_name)
+    await gs_sheets.run(gs_helper.del_ws, sheet_name, sheet=sheet_name)
     await ctx.send(f"Deleted sheet '{sheet_name}'.")
 
 # gs_store_sheet
@@ -1179,7 +1321,7 @@ async def gs_store_sheet(ctx: commands.Context, sheet_name: str) -> None:
 
     @returns: None
     '''
-    gs_helper.store_display(sheet_name)
+    await gs_sheets.run(gs_helper.store_display, sheet_name, sheet=sheet_name)
     await ctx.send(f"Stored sheet '{sheet_name}'.")
 
 # gs_store_sheets
@@ -1191,8 +1333,7 @@ async def gs_store_sheets(ctx: commands.Context) -> None:
 
     @returns: None
     '''
-    gs_helper.store_all_displays()
-    await ctx.send(f"Stored all sheets.")
+    await submit_job(ctx, "store sheets", "store_display", gs_helper.sheet_names())
 
 # # potd_rankings_overall
 # @chain(client.command(), wrapper_funcs)
@@ -1221,8 +1362,8 @@ async def gs_refresh(ctx: commands.Context, sheet_name: str) -> None:
 
     @returns: None
     '''
-    gs_helper.update_display(sheet_name)
-    await ctx.send(f"Refreshed sheet '{sheet_name}'.")
+    cells = await gs_sheets.run(gs_helper.update_display, sheet_name, sheet=sheet_name)
+    await ctx.send(f"Refreshed sheet '{sheet_name}' ({cells} cells written).")
 
 @chain(client.command(), commands.check(is_me), wrapper_funcs)
 async def gs_change_sheet_name(ctx: commands.Context, old_name: str, new_name: str) -> None:
@@ -1234,26 +1375,100 @@ async def gs_change_sheet_name(ctx: commands.Context, old_name: str, new_name: s
 
     @returns: None
     '''
-    gs_helper.change_ws_name(old_name, new_name)
+    await gs_sheets.run(gs_helper.change_ws_name, old_name, new_name)
     await ctx.send(f"Changed sheet name from '{old_name}' to '{new_name}'.")
 
+##### BACKGROUND SHEET JOBS
+
+async def submit_job(ctx, name, op, sheets, args=[]):
+    '''queues op on every sheet in sheets as one background job and replies with its id
+
+    @param ctx (commands.Context): The context of the command.
+    @param name (str): What the job is called in status reports.
+    @param op (str): The registered job op to run on each sheet.
+    @param sheets (list): The names of the sheets to run it on, [None] for one step over the whole spreadsheet.
+    @param args (list): Extra arguments passed to op after the sheet name.
+
+    @returns: None
+    '''
+    if not sheets:
+        await ctx.send("No sheets to update.")
+        return
+    job_id = jobs.submit(name, [(op, sheet, args) for sheet in sheets], ctx.channel.id)
+    described = "all sheets" if sheets == [None] else f"{len(sheets)} sheet{'s' if len(sheets) != 1 else ''}"
+    await ctx.send(f"Queued job {job_id} ({described}). Check on it with `gs_jobs {job_id}`.")
+
+def job_summary(job):
+    counts = jobs.progress(job)
+    summary = f"Job {job['id']} ({job['name']}): {counts['done']}/{len(job['steps'])} done"
+    if counts['failed']: summary += f", {counts['failed']} failed"
+    if counts['running']: summary += f", {counts['running']} running"
+    return summary
+
+async def job_finished(job):
+    '''reports a finished job in the channel it was started from'''
+    channel = client.get_channel(job["channel"]) if job["channel"] is not None else None
+    if channel is None: return
+    cells = sum(step["result"] for step in job["steps"] if isinstance(step["result"], int))
+    message = job_summary(job) + (f" ({cells} cells written)." if cells else ".")
+    failed = [step for step in job["steps"] if step["status"] == "failed"]
+    if failed: message += f" Retry the failed sheets with `gs_retry {job['id']}`."
+    await channel.send(message)
+
+@chain(client.command(), commands.check(is_me), wrapper_funcs)
+async def gs_jobs(ctx: commands.Context, job_id: str = "None") -> None:
+    '''[Admin only] Shows the progress of recent background sheet jobs, or of one job in detail.
+
+    @param ctx (commands.Context): The context of the command.
+    @param job_id (str): The ID of the job to show, or "None" for the most recent jobs.
+
+    @returns: None
+    '''
+    if job_id == "None":
+        recent = jobs.recent()
+        await ctx.send('\n'.join(job_summary(job) for job in recent) if recent else "No jobs.")
+        return
+    job = jobs.jobs.get(job_id)
+    if job is None:
+        await ctx.send(f"Job {job_id} not found.")
+        return
+    lines = [job_summary(job)] + [f"{step['sheet'] or 'all sheets'}: {step['status']}" + (f" ({step['error']})" if step['error'] else "") for step in job["steps"]]
+    await ctx.send('```' + '\n'.join(lines) + '```')
+
+@chain(client.command(), commands.check(is_me), wrapper_funcs)
+async def gs_retry(ctx: commands.Context, job_id: str) -> None:
+    '''[Admin only] Runs the failed sheets of a background job again.
+
+    @param ctx (commands.Context): The context of the command.
+    @param job_id (str): The ID of the job to retry.
+
+    @returns: None
+    '''
+    if job_id not in jobs.jobs:
+        await ctx.send(f"Job {job_id} not found.")
+        return
+    retried = jobs.retry(job_id)
+    await ctx.send(f"Retrying {retried} failed sheet{'s' if retried != 1 else ''} of job {job_id}." if retried else f"Job {job_id} has no failed sheets.")
+
 ##################################################################################
 # DATA
 
 def load_data():
     global constants
-    # potd_driver.load_data()
+    potd_driver.load_data()
     with open(f"{DATA_DIR}data/constants.json", "r") as file:
         constants = json.load(file)
     # potd_driver.season.CURRENT_SEASON = constants["CURRENT_SEASON"]
-def store_data():
-    global constants
-    # potd_driver.store_data()
+def dump_data():
     # constants["CURRENT_SEASON"] = potd_driver.season.CURRENT_SEASON
-    with open(f"{DATA_DIR}data/constants.json", "w") as file:
-        json.dump(constants, file, indent=4)
+    return {f"{DATA_DIR}data/constants.json": json.dumps(constants, indent=4)}
+def store_data():
+    '''marks data as changed, the persistence scheduler writes it once things go quiet'''
+    potd_driver.store_data()
+    persistence.mark_dirty("constants")
 
 load_data()
+persistence.register("constants", dump_data)
 
 ##################################################################################
 # RUN BOT
@@ -1264,13 +1479,74 @@ async def on_ready():
 
     @returns: None
     '''
+    global scheduled_task
     print('Bot is ready')
+    persistence.start()
+    # built here on the event loop, before any sheet job can reach it from a worker thread
+    helper.index()
+    sync_ud_members()
+    jobs.start()
     still_alive.start()
     change_status.start()
     # edit_leaderboard_msg.start()
-    check_scheduled_messages.start()
+    if scheduled_task is None: scheduled_task = asyncio.create_task(check_scheduled_messages())
+    reconcile_reactions.start()
     check_bdays.start()
 
+##### GATEWAY EVENTS
+@client.listen()
+async def on_member_join(member):
+    helper.index().add(member)
+    sync_ud_member(member.id)
+
+@client.listen()
+async def on_member_remove(member):
+    helper.index().remove(member.id)
+    sync_ud_member(member.id)
+
+@client.listen()
+async def on_member_update(before, after):
+    helper.index().update(after)
+    sync_ud_member(after.id)
+
+@client.listen()
+async def on_user_update(before, after):
+    # display names fall back to the global name, which only shows up as a user event
+    member = helper.guild().get_member(after.id)
+    if member is not None: helper.index().update(member)
+
+@client.listen()
+async def on_message(message):
+    helper.remember_message(message.id, message.channel.id)
+
+@client.listen()
+async def on_raw_reaction_add(payload):
+    helper.remember_message(payload.message_id, payload.channel_id)
+    helper.forget_reactions(payload.message_id)
+    tracker.add(payload.message_id, payload.emoji, payload.user_id)
+
+@client.listen()
+async def on_raw_reaction_remove(payload):
+    helper.remember_message(payload.message_id, payload.channel_id)
+    helper.forget_reactions(payload.message_id)
+    tracker.remove(payload.message_id, payload.emoji, payload.user_id)
+
+@client.listen()
+async def on_raw_reaction_clear(payload):
+    helper.forget_reactions(payload.message_id)
+    tracker.clear(payload.message_id)
+
+@client.listen()
+async def on_raw_reaction_clear_emoji(payload):
+    helper.forget_reactions(payload.message_id)
+    tracker.clear(payload.message_id, payload.emoji)
+
+##### REPAIRS TRACKED REACTIONS MISSED WHILE OFFLINE OR DISCONNECTED
+@tasks.loop(hours=1)
+async def reconcile_reactions():
+    drifted = await tracker.reconcile()
+    if drifted: print(f"Reconciled reactions on {drifted} tracked posts")
+
 ##### PRINTS BOT STILL ALIVE
 @tasks.loop(minutes=5)
 async def still_alive():
@@ -1282,9 +1558,18 @@ async def change_status():
   await client.change_presence(activity=discord.Game(next(status)))
 
 helper = discordHelper(client, constants["server_id"])
-gs_helper = google_sheet_updater(helper)
-ud = user_data(helper)
+gs_helper = google_sheet_updater(helper, persistence)
+jobs = job_queue(f"{DATA_DIR}data/jobs.json", gs_sheets, persistence, job_finished, log_error)
+jobs.register("update_display", gs_helper.update_display)
+# every sheet in one batch, retried one sheet at a time if it fails
+jobs.register("update_people", lambda _, names: gs_helper.update_people(names), split=lambda names: [("update_display", sheet_name, []) for sheet_name in gs_helper.sheet_names()])
+jobs.register("store_display", gs_helper.store_display)
+jobs.register("add_potd_season", lambda sheet_name, season_id, date: gs_helper.add_potd_season(potd_driver, helper, sheet_name, season_id, date))
+ud = user_data(helper, persistence)
+tracker = reaction_tracker(helper, persistence)
 
 client.run(TOKEN)
+persistence.flush()
+potd_driver.store_data(compact=True)
 
 ##################################################################################
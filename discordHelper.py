@@ -1,7 +1,7 @@
 from unique_id.unique_id import unique_id
 import pandas as pd, numpy as np, json, copy as cp
-import os, sys, dotenv
-import asyncio, traceback
+import os, sys, dotenv, time
+import asyncio, traceback, threading
 
 ######################################## DISCORD SET UP STUFF
 
@@ -9,6 +9,7 @@ import discord
 from discord.utils import get
 from discord.ext import commands, tasks
 from itertools import cycle 
+from collections import OrderedDict
 status = cycle(['Helping users.', 'Managing servers.'])
 
 intents = discord.Intents.all()
@@ -22,19 +23,155 @@ ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 timezone = 'America/Los_Angeles'
 
+def to_epoch(time_str):
+    '''parses a stored time string (in timezone) into epoch seconds'''
+    stamp = pd.Timestamp(time_str)
+    if stamp.tzinfo is not None: return int(stamp.timestamp())
+    # a wall time repeated when the clocks go back is read as the first one (still daylight time), one
+    # skipped when they go forward as the first minute after the gap, so no stored time fails to load
+    return int(stamp.tz_localize(timezone, ambiguous=True, nonexistent='shift_forward').timestamp())
+
+def now_epoch():
+    return int(time.time())
+
 def log_error(e, act=True):
     '''logs error e'''
     with open(f"{DATA_DIR}error_log.txt", "a") as file:
         file.write(f"[{pd.Timestamp.now(tz='America/Los_Angeles')}]\n{e}\n")
         if act: traceback.print_exc(file=file)
 
+######################################## RATE LIMITING
+
+# (requests, per seconds) discord allows on the routes the bulk operations hit. discord.py also waits
+# on the buckets it reads from the response headers, these keep requests from piling up behind them
+ROUTE_LIMITS = {"dm": (50, 1.0), "roles": (10, 1.0)}
+
+class TokenBucket:
+    '''lets through rate calls per second on average, in bursts of up to capacity'''
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        # nothing goes through before this time, see pause
+        self.paused_until = 0
+
+    @classmethod
+    def for_route(cls, limit, window):
+        '''paced so that no window seconds ever see more than limit calls, the way discord counts a route'''
+        return cls(rate=max(limit - 1, 1) / window, capacity=1)
+
+    def pause(self, seconds):
+        '''holds every caller back for seconds, e.g. the retry_after of a 429'''
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def is_retryable(e):
+    '''rate limited or discord-side errors, anything else (e.g. DMs closed) won't get better by retrying'''
+    status = getattr(e, 'status', None)
+    return isinstance(e, (asyncio.TimeoutError, ConnectionError)) or status == 429 or (status is not None and status >= 500)
+
+######################################## MEMBER INDEX
+
+class MemberIndex:
+    '''role -> member ids, id -> display name / mention and display name -> id, all ids as strings.
+    changed on the event loop only, code in worker threads reads it through names_copy / ids_copy'''
+    def __init__(self, members):
+        self.lock = threading.RLock()
+        self.role_members = {}
+        self.member_roles = {}
+        self.names = {}
+        self.ids = {}
+        self.mentions = {}
+        for member in members:
+            self.add(member)
+
+    def add(self, member):
+        member_id = str(member.id)
+        with self.lock:
+            self.member_roles[member_id] = {role.id for role in member.roles}
+            for role_id in self.member_roles[member_id]:
+                self.role_members.setdefault(role_id, set()).add(member_id)
+            self.names[member_id] = member.display_name
+            self.ids[member.display_name] = member_id
+            self.mentions[member_id] = member.mention
+
+    def remove(self, member_id):
+        member_id = str(member_id)
+        with self.lock:
+            for role_id in self.member_roles.pop(member_id, ()):
+                self.role_members[role_id].discard(member_id)
+            name = self.names.pop(member_id, None)
+            if self.ids.get(name) == member_id: del self.ids[name]
+            self.mentions.pop(member_id, None)
+
+    def update(self, member):
+        # one step for readers, they never see the member missing
+        with self.lock:
+            self.remove(member.id)
+            self.add(member)
+
+    def names_copy(self):
+        with self.lock:
+            return dict(self.names)
+
+    def ids_copy(self):
+        with self.lock:
+            return dict(self.ids)
+
+    def with_roles(self, role_ids):
+        '''ids of members having any of role_ids'''
+        return set().union(*[self.role_members.get(role_id, set()) for role_id in role_ids])
+
+class ReactionCensus:
+    '''who reacted with what on one message, user ids as strings'''
+    def __init__(self, reactions):
+        '''reactions: [(emoji, user ids)] in the order the reactions appear on the message'''
+        self.emojis = [emoji for emoji, _ in reactions]
+        self.reactors = {emoji: list(user_ids) for emoji, user_ids in reactions}
+        self.user_emojis = {}
+        for emoji, user_ids in reactions:
+            for user_id in user_ids:
+                self.user_emojis.setdefault(user_id, []).append(emoji)
+
 ######################################## DISCORD HELPER
 
 class discordHelper:
-    def __init__(self, client, server_id):
+    def __init__(self, client, server_id, route_limits=None):
         self.server_id = server_id
         self.client = client
 
+        # shared by every bulk operation so concurrent commands don't stack their rates
+        route_limits = {**ROUTE_LIMITS, **(route_limits or {})}
+        self.dm_bucket = TokenBucket.for_route(*route_limits["dm"])
+        self.role_bucket = TokenBucket.for_route(*route_limits["roles"])
+
+        # built from the guild on first use, then kept current by member events in bot.py
+        self.member_index = None
+
+        # message id -> channel id, least recently used first
+        self.message_channels = OrderedDict()
+        self.message_cache_size = 10000
+
+        # message id -> ReactionCensus, least recently used first. dropped on every reaction event
+        self.reaction_censuses = OrderedDict()
+        self.reaction_cache_size = 100
+        # message id -> whether a reaction event came in while its census was being fetched
+        self.census_fetches = {}
+
     ################ RETRIEVE
 
     def guild(self):
@@ -47,15 +184,8 @@ class discordHelper:
         return channel
 
     async def get_message(self, channel_id, message_id):
-        channel_id = [channel_id] if type(channel_id) == int else [channel.id for channel in self.guild().channels if channel.type == discord.ChannelType.text]
-        for channel_id in channel_id:
-            chn = self.get_channel(channel_id)
-            try:
-                message = await chn.fetch_message(int(message_id))
-                return True, message
-            except:
-                continue
-        return False, None 
+        message = await self.locate_message(int(message_id), channel_id if type(channel_id) == int else None)
+        return message is not None, message
 
     def get_member(self, member_id):
         member = self.guild().get_member(member_id)
@@ -70,29 +200,111 @@ class discordHelper:
             post = await channel.fetch_message(post_id)
             if post is None:
                 raise Exception("Post not found.")
+            self.remember_message(post.id, channel.id)
             return post
 
-        for channel in self.guild().channels:
+        post = await self.locate_message(post_id)
+        if post is None:
+            raise Exception("Post not found.")
+        return post
+
+    ################ MESSAGE LOCATIONS
+
+    def remember_message(self, message_id, channel_id):
+        '''records which channel a message lives in, fed by gateway events and past lookups'''
+        self.message_channels[message_id] = channel_id
+        self.message_channels.move_to_end(message_id)
+        if len(self.message_channels) > self.message_cache_size:
+            self.message_channels.popitem(last=False)
+
+    async def locate_message(self, message_id, channel_id=None, concurrency=8):
+        '''fetches a message from channel_id, or from wherever it lives if channel_id is None; None if not found'''
+        # a channel given by the caller is the only place looked at, a remembered one may be out of date
+        given = channel_id is not None
+        if not given: channel_id = self.message_channels.get(message_id)
+        if channel_id is not None:
             try:
-                post = await channel.fetch_message(post_id)
-                return post
-            except:
-                continue 
-        
-        raise Exception("Post not found.")
+                message = await self.get_channel(channel_id).fetch_message(message_id)
+                self.remember_message(message_id, channel_id)
+                return message
+            except Exception:
+                if given: return None
+                self.message_channels.pop(message_id, None)
+
+        # probe every channel at once, most recently active first. a message can't be in a channel
+        # whose last message is older than it, so those go last
+        channels = [channel for channel in self.guild().channels if hasattr(channel, 'fetch_message') and channel.id != channel_id]
+        channels.sort(key=lambda channel: ((channel.last_message_id or 0) < message_id, -(channel.last_message_id or 0)))
+
+        message = await self.probe_channels(channels, message_id, concurrency)
+        if message is not None: self.remember_message(message_id, message.channel.id)
+        return message
+
+    async def probe_channels(self, channels, message_id, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+        async def probe(channel):
+            async with semaphore:
+                try:
+                    return await channel.fetch_message(message_id)
+                except Exception:
+                    return None
+
+        tasks = [asyncio.ensure_future(probe(channel)) for channel in channels]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                message = await next_done
+                if message is not None: return message
+            return None
+        finally:
+            for task in tasks: task.cancel()
+
+    ################ REACTIONS
+
+    async def reaction_census(self, message_id, concurrency=4):
+        '''the ReactionCensus of a message, every reaction's users fetched once and concurrently'''
+        census = self.reaction_censuses.get(message_id)
+        if census is not None:
+            self.reaction_censuses.move_to_end(message_id)
+            return census
+
+        self.census_fetches[message_id] = False
+        try:
+            post = await self.get_post(message_id)
+            semaphore = asyncio.Semaphore(concurrency)
+            async def fetch(reaction):
+                async with semaphore:
+                    return str(reaction.emoji), [str(user.id) async for user in reaction.users()]
+            census = ReactionCensus(await asyncio.gather(*[fetch(reaction) for reaction in post.reactions]))
+        finally:
+            stale = self.census_fetches.pop(message_id, True)
+
+        # a census that missed a reaction event is still returned, just not kept
+        if not stale:
+            self.reaction_censuses[message_id] = census
+            if len(self.reaction_censuses) > self.reaction_cache_size:
+                self.reaction_censuses.popitem(last=False)
+        return census
+
+    def forget_reactions(self, message_id):
+        '''called on reaction events, the next census of the message is fetched again'''
+        self.reaction_censuses.pop(message_id, None)
+        if message_id in self.census_fetches: self.census_fetches[message_id] = True
+
+    def index(self):
+        if self.member_index is None:
+            self.member_index = MemberIndex(self.guild().members)
+        return self.member_index
 
     def get_users(self, role_ids = None, not_role_ids = None, member_ids = None, not_member_ids = None):
-        users = []
-        for user in self.guild().members:
-            if not_member_ids != None and user.id in not_member_ids: continue 
-            if member_ids != None and user.id in member_ids:
-                users.append(user)
-                continue
-            if not_role_ids != None and any(role.id in not_role_ids for role in user.roles): continue 
-            if role_ids != None and any(role.id in role_ids for role in user.roles):
-                users.append(user)
-                continue
-        return users
+        # (members with role_ids - members with not_role_ids) + member_ids - not_member_ids
+        index = self.index()
+        ids = index.with_roles(role_ids or []) - index.with_roles(not_role_ids or [])
+        ids |= {str(member_id) for member_id in member_ids or []}
+        ids -= {str(member_id) for member_id in not_member_ids or []}
+
+        guild = self.guild()
+        users = [guild.get_member(int(member_id)) for member_id in sorted(ids, key=int)]
+        return [user for user in users if user is not None]
 
     async def save_image_from_text(self, ctx):
         if len(ctx.message.attachments) > 0:
@@ -104,15 +316,53 @@ class discordHelper:
         else:
             return None
 
+    ################ BULK
+
+    async def bulk_run(self, targets, action, bucket=None, concurrency=20, retries=3, on_progress=None):
+        '''
+        awaits action(target) for every target, at most concurrency at a time and paced by bucket.
+        retryable failures are retried with exponential backoff, a 429 holds back the whole bucket for its
+        retry_after. returns {target: None if it succeeded else the exception}
+        '''
+        semaphore = asyncio.Semaphore(concurrency)
+        results = {}
+        done = 0
+
+        async def run(target):
+            nonlocal done
+            async with semaphore:
+                for attempt in range(retries + 1):
+                    if bucket is not None: await bucket.acquire()
+                    try:
+                        await action(target)
+                        results[target] = None
+                        break
+                    except Exception as e:
+                        results[target] = e
+                        if attempt == retries or not is_retryable(e): break
+                        retry_after = getattr(e, 'retry_after', None)
+                        if retry_after and bucket is not None: bucket.pause(retry_after)
+                        else: await asyncio.sleep(retry_after or 2 ** attempt)
+            done += 1
+            if on_progress is not None: await on_progress(done, len(targets))
+
+        await asyncio.gather(*[run(target) for target in targets])
+        return results
+
     ################ MODIFY
 
     async def create_role(self, name):
         return await self.guild().create_role(name = name)
 
-    async def add_members_to_role(self, role, members):
-        for member in members:
-            await member.add_roles(role)
-        return True
+    async def add_members_to_role(self, role, members, on_progress=None):
+        '''gives role to every member that doesn't have it yet, returns {member: None if it succeeded else the exception}'''
+        members = [member for member in members if role not in member.roles]
+        return await self.bulk_run(members, lambda member: member.add_roles(role), self.role_bucket, on_progress=on_progress)
+
+    async def remove_members_from_role(self, role, members, on_progress=None):
+        '''takes role from every member that has it, returns {member: None if it succeeded else the exception}'''
+        members = [member for member in members if role in member.roles]
+        return await self.bulk_run(members, lambda member: member.remove_roles(role), self.role_bucket, on_progress=on_progress)
 
     ################ INPUT PARSERS
 
@@ -0,0 +1,46 @@
+import asyncio
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+# runs blocking gspread / pandas work for one spreadsheet in worker threads so the discord
+# event loop keeps running
+#
+# at most max_workers calls run at once. calls for the same worksheet run one after another,
+# and calls with sheet=None touch the whole spreadsheet so they wait for everything else
+
+class async_sheets:
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="sheets")
+
+        # asyncio primitives are created inside the running loop
+        self.semaphore = None
+        self.exclusive = None
+        self.locks = {}
+
+    def setup(self):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_workers)
+            self.exclusive = asyncio.Lock()
+
+    async def run(self, func, *args, sheet=None, **kwargs):
+        '''awaits func(*args, **kwargs) in a worker thread, serialized per worksheet sheet'''
+        self.setup()
+        loop = asyncio.get_running_loop()
+        call = partial(func, *args, **kwargs)
+
+        if sheet is None:
+            # take every slot, one exclusive caller at a time so two of them can't deadlock
+            acquired = 0
+            try:
+                async with self.exclusive:
+                    for _ in range(self.max_workers):
+                        await self.semaphore.acquire()
+                        acquired += 1
+                return await loop.run_in_executor(self.executor, call)
+            finally:
+                for _ in range(acquired): self.semaphore.release()
+
+        async with self.locks.setdefault(sheet, asyncio.Lock()):
+            async with self.semaphore:
+                return await loop.run_in_executor(self.executor, call)
@@ -0,0 +1,97 @@
+from collections import Counter
+
+# in-memory stand-in for the parts of gspread google_sheet_updater uses, counting every api call
+#
+#   client = FakeClient()
+#   gs = google_sheet_updater(helper, client=client)
+#   gs.update_people(names)
+#   client.calls  ->  Counter({'worksheets': 1, 'batch_update': 1, 'values_batch_update': 1})
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, sheet_id, title, rows, cols):
+        self.spreadsheet = spreadsheet
+        self.id = sheet_id
+        self.title = title
+        self.row_count = rows
+        self.col_count = cols
+        self.cells = {}
+
+    def update_title(self, title):
+        self.spreadsheet.calls["update_title"] += 1
+        self.title = title
+
+    def resize(self, rows=None, cols=None):
+        self.spreadsheet.calls["resize"] += 1
+        self.set_size(rows, cols)
+
+    def update(self, values, range_name=None, value_input_option=None):
+        self.spreadsheet.calls["update"] += 1
+        self.set_values(values)
+
+    def get_all_values(self):
+        self.spreadsheet.calls["get_all_values"] += 1
+        return [[self.cells.get((row, col), "") for col in range(self.col_count)] for row in range(self.row_count)]
+
+    def set_size(self, rows=None, cols=None):
+        if rows is not None: self.row_count = rows
+        if cols is not None: self.col_count = cols
+        self.cells = {(row, col): value for (row, col), value in self.cells.items() if row < self.row_count and col < self.col_count}
+
+    def set_values(self, values, row=0, col=0):
+        for i, values_row in enumerate(values):
+            for j, value in enumerate(values_row):
+                self.cells[(row + i, col + j)] = value
+
+class FakeSpreadsheet:
+    def __init__(self, calls):
+        self.calls = calls
+        self.sheets = []
+        self.next_id = 0
+
+    def worksheets(self):
+        self.calls["worksheets"] += 1
+        return list(self.sheets)
+
+    def worksheet(self, title):
+        self.calls["worksheet"] += 1
+        for ws in self.sheets:
+            if ws.title == title: return ws
+        raise Exception(f"Worksheet {title} not found")
+
+    def add_worksheet(self, title, rows, cols):
+        self.calls["add_worksheet"] += 1
+        self.next_id += 1
+        ws = FakeWorksheet(self, self.next_id, title, rows, cols)
+        self.sheets.append(ws)
+        return ws
+
+    def del_worksheet(self, ws):
+        self.calls["del_worksheet"] += 1
+        self.sheets.remove(ws)
+
+    def batch_update(self, body):
+        self.calls["batch_update"] += 1
+        for request in body["requests"]:
+            properties = request["updateSheetProperties"]["properties"]
+            ws = next(ws for ws in self.sheets if ws.id == properties["sheetId"])
+            ws.set_size(properties["gridProperties"]["rowCount"], properties["gridProperties"]["columnCount"])
+
+    def values_batch_update(self, body):
+        self.calls["values_batch_update"] += 1
+        for data in body["data"]:
+            title, cell = data["range"].rsplit("!", 1)
+            title = title[1:-1].replace("''", "'")
+            letters = cell.rstrip("0123456789")
+            col = 0
+            for letter in letters: col = col * 26 + ord(letter) - 64
+            ws = next(ws for ws in self.sheets if ws.title == title)
+            ws.set_values(data["values"], int(cell[len(letters):]) - 1, col - 1)
+
+class FakeClient:
+    def __init__(self):
+        self.calls = Counter()
+        self.spreadsheets = {}
+
+    def open(self, name):
+        self.calls["open"] += 1
+        return self.spreadsheets.setdefault(name, FakeSpreadsheet(self.calls))
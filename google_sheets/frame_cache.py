@@ -0,0 +1,140 @@
+import os, re, pickle, threading
+import pandas as pd
+
+import sys
+sys.path.append('..')
+from storage.durable import atomic_write, write_csv
+
+# typed, in-memory cache of the gsdata/ sheet frames
+#
+# each sheet is stored as <name>.pkl (pickle protocol 5), which is the copy that gets read back.
+# <name>.csv is only an export and is written in the background through the persistence scheduler
+# when one is attached. a sheet that only has a csv (older data or a hand-made one) is imported from
+# it on first use
+#
+# frames stay in memory and are read again only when the .pkl changed on disk (mtime). score columns
+# ("<season>: mm/dd/yyyy") are numeric as long as every non-blank value in them is a number, every
+# other column is str
+
+SCORE_COLUMN = re.compile(r"^\d+: \d\d/\d\d/\d{4}$")
+
+def typed(df):
+    df = df.reset_index(drop=True)
+    for column in df.columns:
+        if SCORE_COLUMN.match(str(column)):
+            numbers = pd.to_numeric(df[column], errors="coerce")
+            # text typed into a score cell (e.g. "excused") is kept, so the column stays str
+            blank = df[column].isna() | (df[column].astype(str).str.strip() == "")
+            if not (numbers.isna() & ~blank).any():
+                df[column] = numbers
+                continue
+        df[column] = df[column].fillna("").astype(str)
+    return df
+
+def number_text(value):
+    if pd.isna(value): return ""
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+def as_text(df):
+    '''df as str the way the sheet shows it, so a stored 3.0 and a "3" read back from the sheet compare equal'''
+    df = typed(df)
+    for column in df.columns:
+        if pd.api.types.is_numeric_dtype(df[column]): df[column] = df[column].map(number_text)
+    return df
+
+class frame_cache:
+    def __init__(self, directory, persistence=None):
+        self.directory = directory
+        self.persistence = persistence
+
+        # sheet name -> (mtime of its .pkl, frame)
+        self.frames = {}
+        # sheets whose csv export is behind
+        self.exports = set()
+        self.lock = threading.Lock()
+
+        if persistence is not None: persistence.register("gsdata", self.dump_data)
+
+    def path(self, sheet_name, extension):
+        return f"{self.directory}{sheet_name}.{extension}"
+
+    def mtime(self, sheet_name):
+        try:
+            return os.stat(self.path(sheet_name, "pkl")).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def names(self):
+        '''names of every sheet stored in directory'''
+        names = set()
+        for file in os.listdir(self.directory):
+            name, extension = os.path.splitext(file)
+            if extension in ['.pkl', '.csv']: names.add(name)
+        return sorted(names)
+
+    def exists(self, sheet_name):
+        return os.path.exists(self.path(sheet_name, "pkl")) or os.path.exists(self.path(sheet_name, "csv"))
+
+    ############################################################################
+    # LOAD & STORE
+
+    def load(self, sheet_name):
+        '''the frame for sheet_name (a copy the caller may change), None if there is none'''
+        mtime = self.mtime(sheet_name)
+        with self.lock:
+            cached = self.frames.get(sheet_name)
+        if cached is not None and mtime is not None and cached[0] == mtime:
+            return cached[1].copy()
+
+        if mtime is not None:
+            with open(self.path(sheet_name, "pkl"), "rb") as file:
+                df = pickle.load(file)
+            with self.lock:
+                self.frames[sheet_name] = (mtime, df)
+            return df.copy()
+
+        if not os.path.exists(self.path(sheet_name, "csv")): return None
+        df = pd.read_csv(self.path(sheet_name, "csv"), dtype=str)
+        self.store(sheet_name, df, export=False)
+        return self.frames[sheet_name][1].copy()
+
+    def store(self, sheet_name, df, export=True):
+        df = typed(df)
+        atomic_write(self.path(sheet_name, "pkl"), pickle.dumps(df, protocol=5))
+        with self.lock:
+            self.frames[sheet_name] = (self.mtime(sheet_name), df)
+            if export: self.exports.add(sheet_name)
+
+        if not export: return
+        if self.persistence is not None:
+            self.persistence.mark_dirty("gsdata")
+        else:
+            self.export(sheet_name)
+
+    def export(self, sheet_name):
+        write_csv(self.path(sheet_name, "csv"), self.frames[sheet_name][1])
+
+    def dump_data(self):
+        with self.lock:
+            names, self.exports = self.exports, set()
+            frames = {name: self.frames[name][1] for name in names if name in self.frames}
+        return {self.path(name, "csv"): df.to_csv(index=False) for name, df in frames.items()}
+
+    ############################################################################
+    # FILES
+
+    def delete(self, sheet_name):
+        with self.lock:
+            self.frames.pop(sheet_name, None)
+            self.exports.discard(sheet_name)
+        for extension in ["pkl", "csv"]:
+            if os.path.exists(self.path(sheet_name, extension)): os.remove(self.path(sheet_name, extension))
+
+    def rename(self, old_name, new_name):
+        for extension in ["pkl", "csv"]:
+            if os.path.exists(self.path(old_name, extension)): os.rename(self.path(old_name, extension), self.path(new_name, extension))
+        with self.lock:
+            if old_name in self.frames: self.frames[new_name] = self.frames.pop(old_name)
+            if old_name in self.exports:
+                self.exports.discard(old_name)
+                self.exports.add(new_name)
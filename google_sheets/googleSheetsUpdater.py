@@ -5,6 +5,9 @@ from oauth2client.service_account import ServiceAccountCredentials
 import sys
 sys.path.append('..')
 from discordHelper import *
+from storage.durable import dump_json
+from google_sheets.sheet_batch import sheet_batch, cs
+from google_sheets.frame_cache import frame_cache, as_text
 
 import warnings
 warnings.filterwarnings("ignore")
@@ -18,52 +21,90 @@ pd.set_option('display.max_colwidth', None)
 SHEET_NAME = "[Current] 2025 Oregon ARML Information Survey"
 rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + "/"
 
-def cs(n):
-    string = ""
-    while n > 0:
-        n, remainder = divmod(n - 1, 26)
-        string = chr(65 + remainder) + string
-    return string
-
 class google_sheet_updater:
-    def __init__(self, helper):
-        self.client = gspread.authorize(ServiceAccountCredentials.from_json_keyfile_name(f"{DATA_DIR}gsdata/google_sheets_key.json", ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']))
+    def __init__(self, helper, persistence=None, client=None):
+        if client is None: client = gspread.authorize(ServiceAccountCredentials.from_json_keyfile_name(f"{DATA_DIR}gsdata/google_sheets_key.json", ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']))
+        self.client = client
 
         self.SHEET = self.client.open(SHEET_NAME)
         self.helper = helper
+        self.persistence = persistence
+
+        # title -> worksheet handle, fetched in one call and kept in step with add/delete/rename
+        self.worksheets = None
+        # worksheet id -> rows last pushed to it, so syncs only write changed cells
+        self.snapshots = {}
+        # the local copy of every sheet, see frame_cache
+        self.frames = frame_cache(f"{DATA_DIR}gsdata/", persistence)
 
         self.load_data()
+        if persistence is not None: persistence.register("gsheets", self.dump_data)
 
     ############################################################################
     # HELPERS 
 
+    def refresh_worksheets(self):
+        self.worksheets = {ws.title: ws for ws in self.SHEET.worksheets()}
+
+    def worksheet(self, sheet_name):
+        if self.worksheets is None or sheet_name not in self.worksheets:
+            # may have been added from the google sheets ui since the last refresh
+            self.refresh_worksheets()
+        return self.worksheets.get(sheet_name)
+
+    def flush(self, batch):
+        try:
+            batch.flush()
+        except Exception:
+            # a cached handle may be stale (worksheet renamed or deleted in the google sheets ui), so
+            # every worksheet is looked up again before the next try
+            self.worksheets = None
+            raise
+
+    def add_worksheet(self, sheet_name, rows, cols):
+        ws = self.SHEET.add_worksheet(sheet_name, rows, cols)
+        if self.worksheets is not None: self.worksheets[sheet_name] = ws
+        return ws
+
     def get_ws(self, sheet_name, ws = True):
         if ws:
             try:
-                ws = self.SHEET.worksheet(sheet_name)
+                ws = self.worksheet(sheet_name)
             except:
                 ws = None
         else:
             ws = None
-        return ws, None if not os.path.exists(f"{DATA_DIR}gsdata/{sheet_name}.csv") else pd.read_csv(f"{DATA_DIR}gsdata/{sheet_name}.csv", dtype=str).fillna("").reset_index(drop=True)
+        return ws, self.frames.load(sheet_name)
 
     def get_df_fromsheet(self, sheet_name):
-        return get_as_dataframe(self.SHEET.worksheet(sheet_name), evaluate_formulas=False, parse_dates=False).fillna("").astype(str)
+        # whatever was edited on the sheet is about to be pulled in, so the next push can't trust the snapshot
+        ws = self.worksheet(sheet_name)
+        if ws is not None: self.snapshots.pop(ws.id, None)
+        return get_as_dataframe(self.worksheet(sheet_name), evaluate_formulas=False, parse_dates=False).fillna("").astype(str)
 
     def del_ws(self, sheet_name):
         ws, df = self.get_ws(sheet_name)
-        if ws is not None: self.SHEET.del_worksheet(ws)
-        if not (df is None): os.remove(f"{DATA_DIR}gsdata/{sheet_name}.csv")
+        if ws is not None:
+            self.SHEET.del_worksheet(ws)
+            self.worksheets.pop(sheet_name, None)
+            self.snapshots.pop(ws.id, None)
+        if not (df is None): self.frames.delete(sheet_name)
         return ws is not None or not (df is None)
 
     def change_ws_name(self, old_name, new_name):
         ws, df = self.get_ws(old_name)
-        if ws is not None: ws.update_title(new_name)
-        if not (df is None): os.rename(f"{DATA_DIR}gsdata/{old_name}.csv", f"{DATA_DIR}gsdata/{new_name}.csv")
+        if ws is not None:
+            ws.update_title(new_name)
+            self.worksheets[new_name] = self.worksheets.pop(old_name)
+        if not (df is None): self.frames.rename(old_name, new_name)
         return ws is not None or not (df is None)
 
-    def store_df_to_csv(self, sheet_name, df):
-        df.astype(str).fillna("").reset_index(drop=True).to_csv(f"{DATA_DIR}gsdata/{sheet_name}.csv", index=False)
+    def sheet_names(self):
+        '''names of every sheet kept in gsdata/'''
+        return self.frames.names()
+
+    def store_df(self, sheet_name, df):
+        self.frames.store(sheet_name, df)
 
     ############################################################################
     # DATA STORAGE 
@@ -71,9 +112,13 @@ class google_sheet_updater:
     def load_data(self):
         with open(f'{DATA_DIR}gsdata/data.json') as file:
             self.data = json.load(file)
+    def dump_data(self):
+        return {f'{DATA_DIR}gsdata/data.json': json.dumps(self.data, indent=4)}
     def store_data(self):
-        with open(f'{DATA_DIR}gsdata/data.json', 'w') as file:
-            json.dump(self.data, file, indent=4)
+        if self.persistence is not None:
+            self.persistence.mark_dirty("gsheets")
+            return
+        dump_json(f'{DATA_DIR}gsdata/data.json', self.data)
     
     ############################################################################
     # DISPLAY UPDATES
@@ -84,70 +129,74 @@ class google_sheet_updater:
         new_df = self.get_df_fromsheet(sheet_name)
 
         # change display names to user IDs where possible
-        users = {user.display_name: str(user.id) for user in self.helper.guild().members}
+        users = self.helper.index().ids_copy()
         new_df["Name"] = [users.get(name, name) for name in new_df["Name"]]
 
-        # merge new_df with df, keeping union of keeps but prioritizing new_df
-        df = df.reindex(columns=new_df.columns, fill_value="")
-        df = pd.merge(df, new_df, how="outer").drop_duplicates(subset='Name', keep='last', ignore_index=True)
+        # union of df and new_df, prioritizing new_df: its rows go last, so keep='last' picks them
+        # whatever their values sort as. the sheet comes back as text, so both sides are compared as
+        # the text the sheet shows
+        new_df = as_text(new_df)
+        df = as_text(df.reindex(columns=new_df.columns, fill_value=""))
+        df = pd.concat([df, new_df], ignore_index=True).drop_duplicates(subset='Name', keep='last', ignore_index=True)
 
-        self.store_df_to_csv(sheet_name, df)
+        self.store_df(sheet_name, df)
         self.store_data()
 
 
-    def store_all_displays(self):
-        for file in os.listdir(f'{DATA_DIR}gsdata/'):
-            filename, extension = os.path.splitext(file)
-            if extension == '.csv':
-                self.store_display(filename)
-
-    def update_display(self, sheet_name):
+    def update_display(self, sheet_name, batch = None, df = None):
         # OPEN/CREATE SHEET & CSV 
-        ws, df = self.get_ws(sheet_name)
-        if ws is None: ws = self.SHEET.add_worksheet(sheet_name, len(self.data["names"]) + 1, 2)
+        if df is None: ws, df = self.get_ws(sheet_name)
+        else: ws = self.worksheet(sheet_name)
+        if ws is None: ws = self.add_worksheet(sheet_name, len(self.data["names"]) + 1, 2)
         if df is None: df = pd.DataFrame(columns=["Name"], dtype=str)
 
         # PROCESS NAMES
-        for name in self.data["names"]:
-            if name not in df["Name"].values:
-                df = pd.concat([df, pd.DataFrame({"Name": [name]})], ignore_index=True)
+        present = set(df["Name"])
+        missing = [name for name in dict.fromkeys(self.data["names"]) if name not in present]
+        if missing: df = pd.concat([df, pd.DataFrame({"Name": missing})], ignore_index=True)
         df = df.reset_index(drop=True)
 
-
         df_names = df[df["Name"].isin(self.data["names"])].fillna("").reset_index(drop=True)
 
-        for i in range(len(df_names["Name"])):
-            try:
-                member = self.helper.get_member(int(df_names.loc[i, "Name"]))
-                df_names.loc[i, "Name"] = member.display_name
-            except:
-                continue
+        # ids of current members become display names, anything else is shown as is
+        df_names["Name"] = df_names["Name"].map(self.helper.index().names_copy()).fillna(df_names["Name"])
 
-        df_names = df_names.sort_values(by=["Name"]).reset_index(drop=True)
+        # stable, so rows with the same name keep the order their formulas were written for
+        df_names = df_names.sort_values(by=["Name"], kind="stable").reset_index(drop=True)
         
         # UPDATE DISPLAY
-        ws.resize(cols=len(df_names.columns), rows=len(df_names.index) + 1)
-        ws.update(values=[df_names.columns.values.tolist()] + df_names.values.tolist(), range_name=None, value_input_option='USER_ENTERED')
+        flush = batch is None
+        if flush: batch = sheet_batch(self.SHEET)
+        cells = batch.sync(ws, [df_names.columns.values.tolist()] + df_names.values.tolist(), self.snapshots)
+        if flush: self.flush(batch)
 
         # STORE CSV
-        self.store_df_to_csv(sheet_name, df)
+        self.store_df(sheet_name, df)
+        return cells
 
-    def update_people(self, names):
+    def set_people(self, names):
         self.data["names"] = names
         self.store_data()
 
-        for file in os.listdir(f'{DATA_DIR}gsdata/'):
-            filename, extension = os.path.splitext(file)
-            if extension == '.csv':
-                self.update_display(filename)
+    def update_people(self, names):
+        self.set_people(names)
+
+        # every sheet goes out in the same pair of batch requests
+        batch = sheet_batch(self.SHEET)
+        cells = 0
+        for sheet_name in self.sheet_names():
+            cells += self.update_display(sheet_name, batch)
+        self.flush(batch)
+        return cells
 
     def post_df_to_sheet(self, df, sheet_name):
         ws, _ = self.get_ws(sheet_name)
-        if ws is None: ws = self.SHEET.add_worksheet(sheet_name, 1, 1)
+        if ws is None: ws = self.add_worksheet(sheet_name, 1, 1)
 
-        ws.resize(cols=len(df.columns), rows=len(df.index) + 1)
-
-        ws.update(values=[df.columns.values.tolist()] + df.values.tolist(), range_name=None, value_input_option='USER_ENTERED')
+        batch = sheet_batch(self.SHEET)
+        cells = batch.sync(ws, [df.columns.values.tolist()] + df.values.tolist(), self.snapshots)
+        self.flush(batch)
+        return cells
 
     ############################################################################
     # ADD COLUMNS TO SHEET
@@ -158,7 +207,7 @@ class google_sheet_updater:
         if column_name in df.columns: return None
         df.insert(len(df.columns), column_name, "")
 
-        self.store_df_to_csv(sheet_name, df)
+        self.store_df(sheet_name, df)
         if upd_display: self.update_display(sheet_name)
 
     def add_potd_season(self, driver, helper, sheet_name, season = "None", date = "None"):
@@ -169,43 +218,55 @@ class google_sheet_updater:
         ws, df = self.get_ws(sheet_name)
         if df is None: return None
 
-        self.add_column(sheet_name, f"{season}: {date}", False) 
-
-        users = {user.display_name: str(user.id) for user in helper.guild().members}
+        # adds the column at the end, or overwrites it if the season was added before
         scores = driver.season.get_grades(season)
-        for i in range(len(df["Name"])):
-            score = scores[df.loc[i, "Name"]] if df.loc[i, "Name"] in scores else "0"
-            df.loc[i, f"{season}: {date}"] = str(score)
+        df[f"{season}: {date}"] = df["Name"].map(scores).fillna(0)
 
-        self.store_df_to_csv(sheet_name, df)
+        self.store_df(sheet_name, df)
 
         self.update_display(sheet_name)
 
     ############################################################################
     # CREATE SPECIALIZED SHEETS
 
-    def create_test_sheet(self, test_name, num_questions):
-        # create sheet with test_name
-        self.client.open(SHEET_NAME).add_worksheet(test_name, len(self.data["names"]) + 1, num_questions + 1 + 4)  # Add 1 to account for the "Adjustments" column
-
+    def test_sheet_df(self, num_questions):
         # entire DF type is str
         cols = ["Name", "Adj."] + [f"P{i + 1}" for i in range(num_questions)] + ["TOTAL SCORE", "RANKINGS", "SCORES"] 
-        df = pd.DataFrame(columns=cols, dtype=str)
-        df["Name"] = self.data["names"]
-        df = df.fillna("")
 
-        col = cs(2 + num_questions - 1)
-        for i in range(len(self.data["names"])):
-            df.loc[i, "TOTAL SCORE"] = f"=SUM(B{i + 2}:{col}{i + 2})"
+        # rows go in the order update_display shows them, so each formula sums its own row
+        names = self.helper.index().names_copy()
+        people = sorted(dict.fromkeys(self.data["names"]), key=lambda name: names.get(name, name))
+        df = pd.DataFrame("", index=range(len(people)), columns=cols)
+        df["Name"] = people
+
+        rows = pd.Series(range(2, len(people) + 2)).astype(str)
+        df["TOTAL SCORE"] = "=SUM(B" + rows + f":{cs(2 + num_questions - 1)}" + rows + ")"
 
         total_score_column = cs(2 + num_questions)
-        df.loc[0, "RANKINGS"] = f"=SORT(A2:A, {total_score_column}2:{total_score_column}, FALSE)"
-        df.loc[0, "SCORES"] = f"=SORT({total_score_column}2:{total_score_column}, {total_score_column}2:{total_score_column}, FALSE)"
+        if len(df):
+            df.loc[0, "RANKINGS"] = f"=SORT(A2:A, {total_score_column}2:{total_score_column}, FALSE)"
+            df.loc[0, "SCORES"] = f"=SORT({total_score_column}2:{total_score_column}, {total_score_column}2:{total_score_column}, FALSE)"
+        return df
+
+    def create_test_sheets(self, tests):
+        '''creates a test sheet for every (test_name, num_questions) in tests, all written in one batch.
+        names that already have a worksheet or a stored frame are left alone. returns (cells written, skipped names)'''
+        batch = sheet_batch(self.SHEET)
+        cells = 0
+        skipped = []
+        for test_name, num_questions in tests:
+            if self.worksheet(test_name) is not None or self.frames.exists(test_name):
+                skipped.append(test_name)
+                continue
+            df = self.test_sheet_df(num_questions)
 
-        with open(f"{DATA_DIR}gsdata/{test_name}.csv", "w") as file:
-            df.to_csv(file, index=False)
+            # the worksheet starts out at its final size
+            self.add_worksheet(test_name, len(df) + 1, len(df.columns))
+            cells += self.update_display(test_name, batch, df)
+        self.flush(batch)
+        return cells, skipped
 
-        # update sheet
-        self.update_display(test_name)
+    def create_test_sheet(self, test_name, num_questions):
+        return self.create_test_sheets([(test_name, num_questions)])
 
 ################################################################################
\ No newline at end of file
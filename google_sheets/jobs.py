@@ -0,0 +1,166 @@
+import os, json, time, asyncio, traceback
+
+import sys
+sys.path.append('..')
+from unique_id.unique_id import unique_id
+
+# persistent background queue for long running sheet work
+#
+# a job is a list of steps, each step is one registered op applied to one worksheet (or to the
+# whole spreadsheet when its sheet is None). steps run through an async_sheets facade, so steps on
+# different worksheets run in parallel and steps on the same worksheet run in order. jobs are stored
+# as json after every change, steps that were running when the bot stopped are picked up again on start
+#
+#   jobs.register("update_display", gs_helper.update_display)
+#   job_id = jobs.submit("update people", [("update_display", sheet, []) for sheet in sheets])
+#
+# an op that does many sheets in one step can name how to split it up, a failed step of it is then
+# retried as the smaller steps so one bad sheet doesn't hold back the rest
+#
+#   jobs.register("update_people", lambda _, names: gs_helper.update_people(names), split=lambda names: [...])
+
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+class job_queue:
+    def __init__(self, path, sheets, persistence=None, on_finish=None, on_error=None, keep=50):
+        '''on_finish: async callback(job) run once every step of a job has settled'''
+        self.path = path
+        self.sheets = sheets
+        self.persistence = persistence
+        self.on_finish = on_finish
+        self.on_error = on_error
+        self.keep = keep
+
+        self.ops = {}
+        self.splits = {}
+        self.jobs = {}
+        self.wakeup = None
+        self.task = None
+
+        self.load_data()
+        if persistence is not None: persistence.register("jobs", self.dump_data)
+
+    def register(self, name, func, split=None):
+        '''func(sheet, *args) does the work of one step, split(*args) -> [(op, sheet, args)] the steps a failed one is retried as'''
+        self.ops[name] = func
+        if split is not None: self.splits[name] = split
+
+    ############################################################################
+    # DATA STORAGE
+
+    def load_data(self):
+        if not os.path.exists(self.path): return
+        with open(self.path) as file:
+            self.jobs = {job["id"]: job for job in json.load(file)}
+        for job in self.jobs.values():
+            for step in job["steps"]:
+                if step["status"] == RUNNING: step["status"] = PENDING
+    def dump_data(self):
+        return {self.path: json.dumps(list(self.jobs.values()), indent=4)}
+    def store_data(self):
+        if self.persistence is not None: self.persistence.mark_dirty("jobs")
+
+    ############################################################################
+    # JOBS
+
+    def submit(self, name, steps, channel=None):
+        '''queues steps [(op, sheet, args)] as one job, returns its id'''
+        job_id = str(unique_id())
+        self.jobs[job_id] = {
+            "id": job_id,
+            "name": name,
+            "channel": channel,
+            "created": time.time(),
+            "steps": [self.step(op, sheet, args) for op, sheet, args in steps]
+        }
+        self.prune()
+        self.store_data()
+        self.notify()
+        return job_id
+
+    def step(self, op, sheet, args):
+        return {"op": op, "sheet": sheet, "args": list(args), "status": PENDING, "result": None, "error": None}
+
+    def retry(self, job_id):
+        '''queues the failed steps of a job again (split up where their op can be), returns how many steps were queued'''
+        job = self.jobs.get(job_id)
+        if job is None: return 0
+        steps, retried = [], 0
+        for step in job["steps"]:
+            if step["status"] != FAILED:
+                steps.append(step)
+                continue
+            if step["op"] in self.splits:
+                split = [self.step(op, sheet, args) for op, sheet, args in self.splits[step["op"]](*step["args"])]
+            else:
+                step["status"], step["error"] = PENDING, None
+                split = [step]
+            steps += split
+            retried += len(split)
+        job["steps"] = steps
+        if retried:
+            self.store_data()
+            self.notify()
+        return retried
+
+    def progress(self, job):
+        '''{status: count} over the steps of job'''
+        counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        for step in job["steps"]: counts[step["status"]] += 1
+        return counts
+
+    def finished(self, job):
+        return all(step["status"] in [DONE, FAILED] for step in job["steps"])
+
+    def recent(self, n=10):
+        return sorted(self.jobs.values(), key=lambda job: job["created"], reverse=True)[:n]
+
+    def prune(self):
+        '''forgets the oldest finished jobs past keep'''
+        done = sorted((job for job in self.jobs.values() if self.finished(job)), key=lambda job: job["created"])
+        for job in done[:max(0, len(self.jobs) - self.keep)]:
+            del self.jobs[job["id"]]
+
+    ############################################################################
+    # WORKERS
+
+    def notify(self):
+        if self.wakeup is not None: self.wakeup.set()
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        self.wakeup = asyncio.Event()
+        self.wakeup.set()
+        running = set()
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+
+            # oldest job first, the facade orders steps that share a worksheet
+            for job in sorted(self.jobs.values(), key=lambda job: job["created"]):
+                for step in job["steps"]:
+                    if step["status"] != PENDING: continue
+                    step["status"] = RUNNING
+                    task = asyncio.create_task(self.run_step(job, step))
+                    running.add(task)
+                    task.add_done_callback(running.discard)
+            self.store_data()
+
+    async def run_step(self, job, step):
+        try:
+            func = self.ops[step["op"]]
+            result = await self.sheets.run(func, step["sheet"], *step["args"], sheet=step["sheet"])
+            step["status"], step["result"] = DONE, result if isinstance(result, (int, float, str)) else None
+        except Exception as e:
+            step["status"], step["error"] = FAILED, f"{type(e).__name__}: {e}"
+        self.store_data()
+
+        if self.finished(job) and self.on_finish is not None:
+            try:
+                await self.on_finish(job)
+            except Exception as e:
+                if self.on_error is not None: self.on_error(e)
+                else: traceback.print_exc()
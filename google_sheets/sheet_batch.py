@@ -0,0 +1,90 @@
+# collects writes to any number of worksheets of one spreadsheet and sends them as one
+# spreadsheets.batchUpdate (resizes) plus one values.batchUpdate (cell values)
+#
+# sync() only sends the cells that differ from what was last pushed to the worksheet. the caller
+# owns the snapshots dict (worksheet id -> rows) and should drop a worksheet's entry whenever it
+# may have been edited from outside, e.g. after reading it back
+
+def cs(n):
+    string = ""
+    while n > 0:
+        n, remainder = divmod(n - 1, 26)
+        string = chr(65 + remainder) + string
+    return string
+
+def a1(title, row=1, col=1):
+    '''A1 notation for a cell of worksheet title'''
+    return "'" + title.replace("'", "''") + f"'!{cs(col)}{row}"
+
+def diff_ranges(old, new):
+    '''[(row, col, values)] blocks covering every cell where new differs from old, both the same shape, 0-indexed'''
+    runs = []
+    for i, (old_row, new_row) in enumerate(zip(old, new)):
+        j = 0
+        while j < len(new_row):
+            if old_row[j] == new_row[j]:
+                j += 1
+                continue
+            start = j
+            while j < len(new_row) and old_row[j] != new_row[j]: j += 1
+            runs.append((i, start, j))
+
+    # stack runs spanning the same columns on consecutive rows into one block
+    blocks = []
+    for i, start, end in runs:
+        if blocks and blocks[-1][1] == start and blocks[-1][2] == end and blocks[-1][0] + len(blocks[-1][3]) == i:
+            blocks[-1][3].append(new[i][start:end])
+        else:
+            blocks.append((i, start, end, [new[i][start:end]]))
+    return [(i, start, values) for i, start, end, values in blocks]
+
+def same_shape(old, new):
+    return len(old) == len(new) and all(len(old_row) == len(new_row) for old_row, new_row in zip(old, new))
+
+class sheet_batch:
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+        self.requests = []
+        self.data = []
+        # snapshots are only recorded once the writes actually went through
+        self.pushed = []
+
+    def resize(self, ws, rows, cols):
+        self.requests.append({
+            "updateSheetProperties": {
+                "properties": {"sheetId": ws.id, "gridProperties": {"rowCount": rows, "columnCount": cols}},
+                "fields": "gridProperties(rowCount,columnCount)"
+            }
+        })
+
+    def update(self, ws, values, row=1, col=1):
+        self.data.append({"range": a1(ws.title, row, col), "values": values})
+
+    def write(self, ws, values):
+        '''replaces the whole worksheet with values (list of rows, header included)'''
+        self.resize(ws, len(values), max(1, max(len(row) for row in values)))
+        self.update(ws, values)
+
+    def sync(self, ws, values, snapshots):
+        '''writes only the cells of values that changed since the last sync, everything if the shape changed. returns the number of cells written'''
+        values = [list(row) for row in values]
+        old = snapshots.get(ws.id)
+        if old is None or not same_shape(old, values):
+            self.write(ws, values)
+            cells = sum(len(row) for row in values)
+        else:
+            cells = 0
+            for row, col, block in diff_ranges(old, values):
+                self.update(ws, block, row + 1, col + 1)
+                cells += sum(len(block_row) for block_row in block)
+        self.pushed.append((snapshots, ws.id, values))
+        return cells
+
+    def flush(self):
+        if self.requests:
+            self.spreadsheet.batch_update({"requests": self.requests})
+        if self.data:
+            self.spreadsheet.values_batch_update({"valueInputOption": "USER_ENTERED", "data": self.data})
+        for snapshots, ws_id, values in self.pushed:
+            snapshots[ws_id] = values
+        self.requests, self.data, self.pushed = [], [], []
@@ -0,0 +1,132 @@
+import sys
+sys.path.append('..')
+from discordHelper import *
+from storage.durable import dump_json
+
+# keeps the reactions of tracked posts up to date from gateway events
+#
+# a tracked post is fetched once when it starts being tracked, after that every raw reaction event
+# is applied to the local copy, so reaction reports on it need no api calls. reconcile() fetches
+# every tracked post again to repair anything missed while the bot was offline
+
+class reaction_tracker:
+
+    def __init__(self, helper, persistence=None):
+        self.helper = helper
+        self.persistence = persistence
+
+        # message id -> emoji -> user ids, all as strings
+        self.posts = {}
+        # message id -> events that came in while the post was being fetched
+        self.fetching = {}
+        # posts whose first fetch is still running, untrack takes them out
+        self.starting = set()
+        self.load_data()
+        if persistence is not None: persistence.register("reactions", self.dump_data)
+
+    # load & store
+    def load_data(self):
+        if not os.path.exists(f'{DATA_DIR}data/tracked_posts.json'): return
+        with open(f'{DATA_DIR}data/tracked_posts.json') as file:
+            self.posts = json.load(file)
+
+    def dump_data(self):
+        return {f'{DATA_DIR}data/tracked_posts.json': json.dumps(self.posts, indent=4)}
+
+    def store_data(self):
+        if self.persistence is not None:
+            self.persistence.mark_dirty("reactions")
+            return
+        dump_json(f'{DATA_DIR}data/tracked_posts.json', self.posts)
+
+    # accessors
+    def is_tracked(self, message_id):
+        return str(message_id) in self.posts
+
+    def census(self, message_id):
+        '''ReactionCensus of a tracked post from local state, None if it isn't tracked'''
+        reactions = self.posts.get(str(message_id))
+        if reactions is None: return None
+        return ReactionCensus([(emoji, user_ids) for emoji, user_ids in reactions.items() if user_ids])
+
+    async def reaction_census(self, message_id):
+        '''local census of a tracked post, otherwise one fetched through the helper'''
+        census = self.census(message_id)
+        if census is not None: return census
+        return await self.helper.reaction_census(message_id)
+
+    # tracking
+    async def track(self, message_id):
+        message_id = str(message_id)
+        self.starting.add(message_id)
+        try:
+            await self.fetch(message_id)
+        finally:
+            self.starting.discard(message_id)
+        self.store_data()
+
+    def untrack(self, message_id):
+        message_id = str(message_id)
+        starting = message_id in self.starting
+        self.starting.discard(message_id)
+        if self.posts.pop(message_id, None) is None and not starting: return False
+        self.store_data()
+        return True
+
+    async def fetch(self, message_id):
+        '''
+        replaces the local copy of a post with its reactions as they are now, returns whether anything
+        changed. a post untracked while the fetch was waiting stays untracked
+        '''
+        self.fetching[message_id] = []
+        try:
+            self.helper.forget_reactions(int(message_id))
+            census = await self.helper.reaction_census(int(message_id))
+        finally:
+            events = self.fetching.pop(message_id)
+
+        reactions = {emoji: list(user_ids) for emoji, user_ids in census.reactors.items()}
+        # the fetch may have read the post before or after these, applying them again settles it
+        for event in events: self.apply(reactions, *event)
+        if message_id not in self.posts and message_id not in self.starting: return False
+        changed = self.posts.get(message_id) != reactions
+        self.posts[message_id] = reactions
+        return changed
+
+    async def reconcile(self):
+        '''fetches every tracked post again, returns the number that had drifted'''
+        drifted = 0
+        for message_id in list(self.posts):
+            try:
+                drifted += await self.fetch(message_id)
+            except Exception as e:
+                log_error(f"Could not reconcile reactions of {message_id} -- {e}", False)
+        if drifted: self.store_data()
+        return drifted
+
+    # gateway events
+    def apply(self, reactions, op, emoji, user_id):
+        user_ids = reactions.setdefault(emoji, []) if emoji is not None else None
+        if op == 'add' and user_id not in user_ids: user_ids.append(user_id)
+        elif op == 'remove' and user_id in user_ids: user_ids.remove(user_id)
+        elif op == 'clear':
+            if emoji is None: reactions.clear()
+            else: reactions.pop(emoji, None)
+
+    def event(self, message_id, op, emoji=None, user_id=None):
+        message_id = str(message_id)
+        emoji = str(emoji) if emoji is not None else None
+        user_id = str(user_id) if user_id is not None else None
+        if message_id in self.fetching: self.fetching[message_id].append((op, emoji, user_id))
+        if message_id not in self.posts: return
+        self.apply(self.posts[message_id], op, emoji, user_id)
+        self.store_data()
+
+    def add(self, message_id, emoji, user_id):
+        self.event(message_id, 'add', emoji, user_id)
+
+    def remove(self, message_id, emoji, user_id):
+        self.event(message_id, 'remove', emoji, user_id)
+
+    def clear(self, message_id, emoji=None):
+        self.event(message_id, 'clear', emoji)
@@ -0,0 +1,50 @@
+import os, json, tempfile
+
+# crash-safe file writes
+#
+# data goes to a temp file in the same directory, is fsynced, and is renamed over the target, so
+# a crash leaves either the old file or the new one but never a truncated one. with generations > 0
+# the previous versions are kept as path.1 (newest) ... path.N (oldest)
+
+def rotate_generations(path, generations):
+    if generations <= 0 or not os.path.exists(path): return
+    for i in range(generations - 1, 0, -1):
+        if os.path.exists(f"{path}.{i}"):
+            os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+    # hard link so the target itself never disappears
+    try:
+        if os.path.exists(f"{path}.1"): os.remove(f"{path}.1")
+        os.link(path, f"{path}.1")
+    except OSError:
+        with open(path, 'rb') as src, open(f"{path}.1", 'wb') as dst:
+            dst.write(src.read())
+
+def atomic_write(path, data, generations=0, fsync=True):
+    '''atomically replaces path with data (str or bytes)'''
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        # mkstemp creates the file as 0600, keep the permissions of the file being replaced
+        os.chmod(tmp_path, os.stat(path).st_mode & 0o777 if os.path.exists(path) else 0o644)
+        with os.fdopen(fd, 'wb' if isinstance(data, bytes) else 'w') as file:
+            file.write(data)
+            if fsync:
+                file.flush()
+                os.fsync(file.fileno())
+        rotate_generations(path, generations)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        raise
+
+    if fsync and hasattr(os, 'O_DIRECTORY'):
+        # make the rename itself durable
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try: os.fsync(dir_fd)
+        finally: os.close(dir_fd)
+
+def dump_json(path, obj, indent=4, generations=0, fsync=True):
+    atomic_write(path, json.dumps(obj, indent=indent), generations, fsync)
+
+def write_csv(path, df, generations=0, fsync=True):
+    atomic_write(path, df.to_csv(index=False), generations, fsync)
@@ -0,0 +1,161 @@
+import os, json, asyncio, threading, traceback
+from storage.durable import atomic_write
+
+# append-only journal of driver mutations, folded into a single snapshot file on compaction
+#
+# every record carries a sequence number and the snapshot stores the last sequence number it
+# contains, so a crash between writing the snapshot and truncating the journal never replays
+# a mutation twice
+#
+# compaction takes the snapshot and moves the journal aside (journal.old.jsonl) on the caller's
+# thread, new records go to a fresh journal. serializing and writing the snapshot happens in the
+# default executor when an event loop is running, journal.old.jsonl is removed once it's on disk
+
+class JournalStore:
+    def __init__(self, directory, compact_every=1000):
+        self.directory = directory
+        self.snapshot_path = f"{directory}snapshot.json"
+        self.journal_path = f"{directory}journal.jsonl"
+        self.old_journal_path = f"{directory}journal.old.jsonl"
+        self.compact_every = compact_every
+        # everything is always loaded into memory
+        self.partial = False
+        # set while load replays the journal, so the replayed mutations aren't journaled again
+        self.replaying = False
+        # the driver recording into this store, set by Driver
+        self.driver = None
+
+        self.seq = 0
+        self.num_records = 0
+        self.file = None
+        # byte offset just past the last complete record read_journal saw
+        self.journal_end = 0
+        # set while a snapshot is written in the background, the lock orders snapshot writes
+        self.compacting = False
+        self.write_lock = threading.Lock()
+        self.written_seq = 0
+
+    ################ RECORD
+
+    def record(self, op, args, kwargs):
+        '''appends one mutation to the journal'''
+        if self.file is None:
+            self.file = open(self.journal_path, 'a')
+        self.seq += 1
+        self.num_records += 1
+        self.file.write(json.dumps([self.seq, op, list(args), kwargs]) + "\n")
+        self.file.flush()
+
+    def read_journal(self, path=None):
+        '''yields (seq, op, args, kwargs) for every complete record in the journal at path'''
+        if path is None: path = self.journal_path
+        self.journal_end = 0
+        if not os.path.exists(path): return
+        with open(path, 'rb') as file:
+            for line in file:
+                try:
+                    # a record is complete once its newline is on disk
+                    if not line.endswith(b"\n"): raise ValueError
+                    seq, op, args, kwargs = json.loads(line)
+                except ValueError:
+                    # torn write at the tail of the journal
+                    break
+                self.journal_end += len(line)
+                yield seq, op, args, kwargs
+
+    def truncate_torn_tail(self):
+        '''cuts the journal back to its last complete record, so the next append starts on a fresh line'''
+        if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) > self.journal_end:
+            with open(self.journal_path, 'r+b') as file:
+                file.truncate(self.journal_end)
+                file.flush()
+                os.fsync(file.fileno())
+
+    ################ LOAD & STORE
+
+    def load(self, driver):
+        self.replaying = True
+        try:
+            self.replay(driver)
+        finally:
+            self.replaying = False
+
+    def replay(self, driver):
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r') as file:
+                snapshot = json.load(file)
+            self.seq = snapshot['seq']
+            driver.from_load(snapshot)
+        else:
+            # no snapshot yet, fall back to the legacy data files
+            driver.from_load(self.load_legacy())
+
+        self.num_records = 0
+        # the journal moved aside by a compaction that never finished comes first
+        for path in [self.old_journal_path, self.journal_path]:
+            for seq, op, args, kwargs in self.read_journal(path):
+                if seq <= self.seq: continue
+                driver.replay(op, args, kwargs)
+                self.seq = seq
+                self.num_records += 1
+        self.truncate_torn_tail()
+        self.written_seq = self.seq
+
+        if os.path.exists(self.old_journal_path): self.compact(driver)
+
+    def load_legacy(self):
+        load = {'problems': [], 'ungraded': [], 'scheduled_messages': {}}
+        for key, filename in [('problems', 'data.json'), ('ungraded', 'ungraded.json'), ('scheduled_messages', 'scheduled_messages.json')]:
+            if os.path.exists(f"{self.directory}{filename}"):
+                with open(f"{self.directory}{filename}", 'r') as file:
+                    load[key] = json.load(file)
+        return load
+
+    def store(self, driver):
+        '''mutations are already on disk, only compact once the journal grows too long'''
+        if self.num_records < self.compact_every or self.compacting: return
+        snapshot = self.roll(driver)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.write_snapshot(snapshot)
+            return
+        self.compacting = True
+        loop.run_in_executor(None, self.write_snapshot, snapshot).add_done_callback(self.compacted)
+
+    def compact(self, driver):
+        '''folds the journal into a new snapshot right away'''
+        self.write_snapshot(self.roll(driver))
+
+    def roll(self, driver):
+        '''the snapshot as of the last record, the journal so far moves aside and new records start a fresh one'''
+        snapshot = driver.to_load()
+        snapshot['seq'] = self.seq
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if os.path.exists(self.journal_path):
+            if os.path.exists(self.old_journal_path):
+                # an earlier snapshot never made it to disk, its records stay in front
+                with open(self.old_journal_path, 'ab') as old, open(self.journal_path, 'rb') as journal:
+                    old.write(journal.read())
+                os.remove(self.journal_path)
+            else:
+                os.replace(self.journal_path, self.old_journal_path)
+        self.num_records = 0
+        return snapshot
+
+    def write_snapshot(self, snapshot):
+        with self.write_lock:
+            # a newer snapshot already covers this one
+            if snapshot['seq'] < self.written_seq: return
+            atomic_write(self.snapshot_path, json.dumps(snapshot), generations=2)
+            self.written_seq = snapshot['seq']
+            if os.path.exists(self.old_journal_path): os.remove(self.old_journal_path)
+
+    def compacted(self, future):
+        self.compacting = False
+        if future.exception() is not None:
+            # journal.old.jsonl is still there, the next compaction or load picks it up
+            traceback.print_exception(future.exception())
@@ -0,0 +1,90 @@
+import time, asyncio, threading, traceback
+from storage.durable import atomic_write
+
+# coalesces bursts of "this data changed" marks into one background write
+#
+# each target registers a dump function returning {path: text}. dumping happens on the event loop
+# so the data can't change underneath it, the file writes happen in the default executor
+
+class PersistenceScheduler:
+    def __init__(self, quiet_period=2.0, max_delay=30.0, generations=2, on_error=None):
+        self.quiet_period = quiet_period
+        self.max_delay = max_delay
+        self.generations = generations
+        self.on_error = on_error
+
+        self.targets = {}
+        self.dirty = set()
+        # mark_dirty may be called from worker threads
+        self.lock = threading.Lock()
+        self.written = {}
+        self.changed = None
+        self.loop = None
+        self.task = None
+
+    ################ TARGETS
+
+    def register(self, name, dump):
+        self.targets[name] = dump
+
+    def mark_dirty(self, name):
+        '''safe to call from worker threads as well as the event loop'''
+        with self.lock:
+            self.dirty.add(name)
+        if self.loop is not None: self.loop.call_soon_threadsafe(self.changed.set)
+
+    def collect(self):
+        '''dumps every dirty target, skipping files whose contents did not change'''
+        with self.lock:
+            names, self.dirty = self.dirty, set()
+        files = {}
+        for name in names:
+            files.update(self.targets[name]())
+        return {path: text for path, text in files.items() if self.written.get(path) != text}
+
+    def write(self, files):
+        for path, text in files.items():
+            atomic_write(path, text, self.generations)
+            self.written[path] = text
+
+    ################ BACKGROUND LOOP
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.changed = asyncio.Event()
+        self.loop = loop
+        if self.dirty: self.changed.set()
+
+        while True:
+            await self.changed.wait()
+
+            # wait for a quiet period, but never hold changes back longer than max_delay
+            start = time.monotonic()
+            while time.monotonic() - start < self.max_delay:
+                self.changed.clear()
+                try:
+                    await asyncio.wait_for(self.changed.wait(), timeout=self.quiet_period)
+                except asyncio.TimeoutError:
+                    break
+            self.changed.clear()
+
+            try:
+                with self.lock:
+                    names = set(self.dirty)
+                files = self.collect()
+                if files: await loop.run_in_executor(None, self.write, files)
+            except Exception as e:
+                # try again after the next quiet period
+                with self.lock:
+                    self.dirty |= names
+                self.changed.set()
+                if self.on_error is not None: self.on_error(e)
+                else: traceback.print_exc()
+
+    def flush(self):
+        '''writes everything still dirty right away, used on shutdown'''
+        self.write(self.collect())
@@ -0,0 +1,184 @@
+import json, sqlite3
+from storage.durable import dump_json
+
+# sqlite backed store for the potd driver
+#
+# every journaled mutation is written through to the rows it touches, so the database is always
+# in sync with memory. when only some seasons are loaded (partial), the season falls back to the
+# database for problems and grades that are not in memory
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS problems (
+    id TEXT PRIMARY KEY,
+    season_id TEXT NOT NULL,
+    problem_text TEXT,
+    answer TEXT,
+    start_time TEXT,
+    end_time TEXT
+);
+CREATE INDEX IF NOT EXISTS problems_season ON problems (season_id);
+
+CREATE TABLE IF NOT EXISTS attempts (
+    problem_id TEXT NOT NULL,
+    person_id TEXT NOT NULL,
+    num_attempts INTEGER,
+    grade REAL,
+    responses TEXT,
+    PRIMARY KEY (problem_id, person_id)
+);
+CREATE INDEX IF NOT EXISTS attempts_person ON attempts (person_id);
+
+CREATE TABLE IF NOT EXISTS ungraded (
+    position INTEGER PRIMARY KEY,
+    problem_id TEXT,
+    person_id TEXT,
+    answer TEXT,
+    filename TEXT
+);
+
+CREATE TABLE IF NOT EXISTS scheduled_messages (
+    id TEXT PRIMARY KEY,
+    message TEXT
+);
+'''
+
+GRADES_QUERY = '''
+WITH solves AS (
+    SELECT attempts.problem_id, SUM(MAX(0, MIN(attempts.grade, 1))) AS num_solves
+    FROM attempts JOIN problems ON problems.id = attempts.problem_id
+    WHERE problems.season_id = ?
+    GROUP BY attempts.problem_id
+)
+SELECT attempts.person_id, SUM(attempts.grade * (10 + (100.0 / solves.num_solves) / attempts.num_attempts))
+FROM attempts JOIN solves ON solves.problem_id = attempts.problem_id
+WHERE solves.num_solves > 0 AND attempts.grade > 0
+GROUP BY attempts.person_id
+'''
+
+class SqliteStore:
+    def __init__(self, path, seasons=None):
+        '''seasons: list of season ids to keep in memory, None loads everything'''
+        self.path = path
+        self.seasons = None if seasons is None else [str(season) for season in seasons]
+        self.partial = seasons is not None
+        # set while load fills the driver, see JournalStore.replaying
+        self.replaying = False
+        # the driver recording into this store, set by Driver
+        self.driver = None
+
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    ################ RECORD
+
+    def record(self, op, args, kwargs):
+        '''writes the rows touched by one driver mutation'''
+        season = self.driver.season
+        with self.conn:
+            if op == 'load_problem':
+                self.put_problem(args[0])
+            elif op == 'delete_problem':
+                self.conn.execute("DELETE FROM problems WHERE id = ?", (args[0],))
+                self.conn.execute("DELETE FROM attempts WHERE problem_id = ?", (args[0],))
+            elif op in ['set_time', 'set_season', 'set_answer']:
+                problem = season.get_problem(args[0])
+                if problem is None: return
+                self.put_problem(problem.to_load(), op == 'set_answer')
+            elif op in ['set_attempts', 'set_grade', 'grade_answer']:
+                problem = season.get_problem(args[0])
+                person = problem.get_person(args[1]) if problem is not None else None
+                if person is None: return
+                self.put_person(problem.id, person.to_load())
+            elif op in ['push_ungraded', 'pop_ungraded', 'rotate_ungraded']:
+                self.put_ungraded(season.ungraded_answers)
+            elif op == 'set_scheduled_message':
+                self.conn.execute("INSERT OR REPLACE INTO scheduled_messages VALUES (?, ?)", (args[0], json.dumps(args[1])))
+            elif op == 'remove_scheduled_message':
+                self.conn.execute("DELETE FROM scheduled_messages WHERE id = ?", (args[0],))
+
+    def put_problem(self, load, persons=True):
+        self.conn.execute("INSERT OR REPLACE INTO problems VALUES (?, ?, ?, ?, ?, ?)",
+            (load['id'], load['season_id'], load['problem_text'], load['answer'], load['start_time'], load['end_time']))
+        if persons:
+            for person in load['persons']:
+                self.put_person(load['id'], person)
+
+    def put_person(self, problem_id, load):
+        self.conn.execute("INSERT OR REPLACE INTO attempts VALUES (?, ?, ?, ?, ?)",
+            (problem_id, load['id'], load['num_attempts'], load['grade'], json.dumps(load['responses'])))
+
+    def put_ungraded(self, ungraded_answers):
+        # the queue is short and gets reordered by rotate, so it is rewritten whole
+        self.conn.execute("DELETE FROM ungraded")
+        self.conn.executemany("INSERT INTO ungraded VALUES (?, ?, ?, ?, ?)",
+            [(i, answer['problem_id'], answer['person_id'], answer['answer'], answer['filename']) for i, answer in enumerate(ungraded_answers)])
+
+    ################ QUERIES
+
+    def get_problem(self, problem_id):
+        row = self.conn.execute("SELECT * FROM problems WHERE id = ?", (problem_id,)).fetchone()
+        if row is None: return None
+        return self.problem_load(row)
+
+    def get_grades(self, season_id):
+        return {person_id: score for person_id, score in self.conn.execute(GRADES_QUERY, (season_id,))}
+
+    def problem_load(self, row):
+        problem_id, season_id, problem_text, answer, start_time, end_time = row
+        persons = [
+            {'id': person_id, 'num_attempts': num_attempts, 'grade': grade, 'responses': json.loads(responses)}
+            for person_id, num_attempts, grade, responses in self.conn.execute("SELECT person_id, num_attempts, grade, responses FROM attempts WHERE problem_id = ?", (problem_id,))
+        ]
+        return {'problem_text': problem_text, 'answer': answer, 'start_time': start_time, 'end_time': end_time, 'season_id': season_id, 'id': problem_id, 'persons': persons}
+
+    ################ LOAD & STORE
+
+    def to_load(self, seasons=None):
+        if seasons is None:
+            rows = self.conn.execute("SELECT * FROM problems").fetchall()
+        else:
+            rows = self.conn.execute(f"SELECT * FROM problems WHERE season_id IN ({', '.join('?' * len(seasons))})", seasons).fetchall()
+        return {
+            'problems': [self.problem_load(row) for row in rows],
+            'ungraded': [
+                {'problem_id': problem_id, 'person_id': person_id, 'answer': answer, 'filename': filename}
+                for _, problem_id, person_id, answer, filename in self.conn.execute("SELECT * FROM ungraded ORDER BY position")
+            ],
+            'scheduled_messages': {message_id: json.loads(message) for message_id, message in self.conn.execute("SELECT * FROM scheduled_messages")},
+            # counted over every season, so a partial load never hands out the id of a problem it left out
+            'last_problem_id': self.conn.execute("SELECT COALESCE(MAX(CAST(id AS INTEGER)), 0) FROM problems").fetchone()[0]
+        }
+
+    def from_load(self, load):
+        with self.conn:
+            for table in ['problems', 'attempts', 'ungraded', 'scheduled_messages']:
+                self.conn.execute(f"DELETE FROM {table}")
+            for problem in load['problems']:
+                self.put_problem(problem)
+            self.put_ungraded(load['ungraded'])
+            self.conn.executemany("INSERT INTO scheduled_messages VALUES (?, ?)", [(i, json.dumps(j)) for i, j in load['scheduled_messages'].items()])
+
+    def load(self, driver):
+        self.driver = driver
+        self.replaying = True
+        try:
+            driver.from_load(self.to_load(self.seasons))
+        finally:
+            self.replaying = False
+
+    def store(self, driver):
+        '''every mutation is committed as it happens'''
+        return
+
+    def compact(self, driver):
+        self.conn.execute("VACUUM")
+
+    ################ JSON IMPORT & EXPORT
+
+    def import_json(self, path):
+        '''replaces the database with a json file in the Driver.to_load format'''
+        with open(path, 'r') as file:
+            self.from_load(json.load(file))
+
+    def export_json(self, path):
+        dump_json(path, self.to_load())
@@ -1,9 +1,48 @@
-import os
+import os, threading
+from storage.durable import atomic_write
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ids are reserved from unique_id.txt in blocks and handed out from memory
+#
+# unique_id.txt holds the high-water mark: every id below it may have been handed out already. a
+# reservation bumps it by BLOCK_SIZE under a file lock, so ids stay unique across processes and
+# monotonic across restarts (unused ids of a block are skipped)
+
+BLOCK_SIZE = 1000
+ID_PATH = f"{os.path.dirname(__file__)}/unique_id.txt"
+
+class id_allocator:
+    def __init__(self, path=ID_PATH, block_size=BLOCK_SIZE):
+        self.path = path
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.block_end = 0
+
+    def reserve_block(self):
+        with open(f"{self.path}.lock", "a") as lock_file:
+            if fcntl is not None: fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(self.path, "r") as file:
+                    start = int(file.read())
+                atomic_write(self.path, str(start + self.block_size))
+            finally:
+                if fcntl is not None: fcntl.flock(lock_file, fcntl.LOCK_UN)
+        self.next_id, self.block_end = start, start + self.block_size
+
+    def allocate(self):
+        with self.lock:
+            if self.next_id >= self.block_end:
+                self.reserve_block()
+            _id = self.next_id
+            self.next_id += 1
+            return _id
+
+allocator = id_allocator()
 
 def unique_id():
-    _id = None
-    with open(f"{os.path.dirname(__file__)}/unique_id.txt", "r") as file:
-        _id = int(file.read())
-    with open(f"{os.path.dirname(__file__)}/unique_id.txt", "w") as file:
-        file.write(str(_id+1))
-    return _id
+    return allocator.allocate()
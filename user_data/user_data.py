@@ -1,6 +1,10 @@
-import sys
+import sys, re, calendar, datetime
+from bisect import bisect_left, insort
+from contextlib import contextmanager
 sys.path.append('..')
 from discordHelper import *
+from storage.durable import dump_json
+from google_sheets.sheet_batch import sheet_batch
 
 import gspread
 from gspread_dataframe import get_as_dataframe
@@ -11,44 +15,172 @@ from oauth2client.service_account import ServiceAccountCredentials
 
 SHEET_NAME = "User Data"
 WORKSHEET_NAME = "User Data"
+COMPETITOR_KEY = "Competitor_"
+
+BIRTHDAY_KEY = "Date of Birth_"
+NUMERIC_DATE = re.compile(r"^(\d{1,2})[/.-](\d{1,2})(?:[/.-]\d{2,4})?$")
+ISO_DATE = re.compile(r"^\d{4}-(\d{1,2})-(\d{1,2})$")
+NAMED_DATE_FORMATS = ["%B %d %Y", "%b %d %Y", "%d %B %Y", "%d %b %Y", "%B %d", "%b %d", "%d %B", "%d %b"]
+
+def parse_birthday(value):
+    '''(month, day) of a date of birth written as m/d/y, m/d, m-d-y, yyyy-mm-dd or with the month name, None if it can't be read'''
+    value = str(value).strip()
+    match = ISO_DATE.match(value) or NUMERIC_DATE.match(value)
+    if match is not None:
+        month, day = int(match.group(1)), int(match.group(2))
+    else:
+        value = value.replace(",", " ")
+        value = " ".join(value.split())
+        for date_format in NAMED_DATE_FORMATS:
+            try:
+                # 2000 is a leap year, so feb 29 parses when the year is left out
+                date = datetime.datetime.strptime(value if "%Y" in date_format else f"{value} 2000", date_format if "%Y" in date_format else f"{date_format} %Y")
+                month, day = date.month, date.day
+                break
+            except ValueError:
+                continue
+        else:
+            return None
+    if not 1 <= month <= 12 or not 1 <= day <= calendar.monthrange(2000, month)[1]: return None
+    return month, day
 
 class user_data:
 
-    def __init__(self, helper):
+    def __init__(self, helper, persistence=None, client=None):
 
-        self.client = gspread.authorize(ServiceAccountCredentials.from_json_keyfile_name(f"{DATA_DIR}gsdata/google_sheets_key.json", ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']))
+        if client is None: client = gspread.authorize(ServiceAccountCredentials.from_json_keyfile_name(f"{DATA_DIR}gsdata/google_sheets_key.json", ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']))
+        self.client = client
 
         self.SHEET = self.client.open(SHEET_NAME)
         self.helper = helper
+        self.persistence = persistence
 
         self.keys = []
         self.data = {}
+        # user id x (COMPETITOR_KEY + keys) frame of the data as str, '-' where unset, with a row for every
+        # competitor even without data. kept in step by the mutators and the member updates
+        self.frame = None
+        # ids of the server members and of the ones with the year role, see set_members
+        self.members = set()
+        self.competitors = set()
+        # (month, day) -> user ids born that day, every user's (month, day), and the days in order
+        self.birthdays = {}
+        self.user_birthdays = {}
+        self.birthday_days = []
+        # store_data is held back while a batch is open
+        self.batch_depth = 0
+        self.batch_dirty = False
+        # worksheet id -> rows last pushed to it, see sheet_batch.sync
+        self.snapshots = {}
         self.load_data()
+        if persistence is not None: persistence.register("user_data", self.dump_data)
 
     # load & store
     def load_data(self):
         with open(f'{DATA_DIR}user_data/data.json') as file:
             self.data = json.load(file)
             self.keys, self.data = self.data['keys'], self.data['data']
+        self.frame = self.build_frame()
+        self.index_birthdays()
+
+    def dump_data(self):
+        return {f'{DATA_DIR}user_data/data.json': json.dumps({'keys': self.keys, 'data': self.data}, indent=4)}
 
     def store_data(self):
-        with open(f'{DATA_DIR}user_data/data.json', 'w') as file:
-            json.dump({'keys': self.keys, 'data': self.data}, file, indent=4)
+        if self.batch_depth:
+            self.batch_dirty = True
+            return
+        if self.persistence is not None:
+            self.persistence.mark_dirty("user_data")
+            return
+        dump_json(f'{DATA_DIR}user_data/data.json', {'keys': self.keys, 'data': self.data}, generations=2)
     
+    @contextmanager
+    def batch(self):
+        '''mutations inside are stored once, when the outermost batch ends'''
+        self.batch_depth += 1
+        try:
+            yield self
+        finally:
+            self.batch_depth -= 1
+            if self.batch_depth == 0 and self.batch_dirty:
+                self.batch_dirty = False
+                self.store_data()
+
     # accessors 
-    def data_as_df(self):
-        return pd.DataFrame(self.data).fillna("-").astype(str).T
+    def competitor_value(self, user_id):
+        '''1 for competitors, 0 for other members, the id itself for people no longer in the server'''
+        return 1 if user_id in self.competitors else (0 if user_id in self.members else user_id)
+
+    def build_frame(self):
+        user_ids = list(self.data) + sorted(self.competitors - self.data.keys(), key=int)
+        rows = []
+        for user_id in user_ids:
+            values = self.data.get(user_id, {})
+            rows.append([self.competitor_value(user_id)] + [str(values[key]) if key in values else "-" for key in self.keys])
+        return pd.DataFrame(rows, index=user_ids, columns=[COMPETITOR_KEY] + self.keys, dtype=object)
 
     def get_keys(self):
         return self.keys 
 
+    def birthdays_on(self, month, day):
+        return sorted(self.birthdays.get((month, day), []), key=int)
+
+    def upcoming_birthdays(self, n, today=None):
+        '''[(month, day, user_id)] of the next n birthdays from today on, in order'''
+        if today is None: today = datetime.date.today()
+        if not self.birthday_days: return []
+        start = bisect_left(self.birthday_days, (today.month, today.day))
+        upcoming = []
+        for i in range(len(self.birthday_days)):
+            month, day = self.birthday_days[(start + i) % len(self.birthday_days)]
+            for user_id in self.birthdays_on(month, day):
+                if len(upcoming) == n: return upcoming
+                upcoming.append((month, day, user_id))
+        return upcoming
+
+    def get_user(self, user_id):
+        '''{key: value} for every key, '-' where unset'''
+        values = self.data.get(str(user_id), {})
+        return {key: str(values[key]) if key in values else "-" for key in self.keys}
+
     # mutators
     def create_user(self, user_id):
-        if user_id in self.data:
-            return False
+        return self.create_users([user_id]) == 1
+
+    def create_users(self, user_ids):
+        '''adds every user not in the data yet, returns how many were added'''
+        new = [user_id for user_id in dict.fromkeys(map(str, user_ids)) if user_id not in self.data]
+        if not new: return 0
+        for user_id in new: self.data[user_id] = {}
+        self.add_rows([user_id for user_id in new if user_id not in self.frame.index])
+        return len(new)
+
+    def add_rows(self, user_ids):
+        if not user_ids: return
+        self.frame = self.frame.reindex(self.frame.index.append(pd.Index(user_ids)), fill_value="-")
+        self.frame.loc[user_ids, COMPETITOR_KEY] = [self.competitor_value(user_id) for user_id in user_ids]
+
+    def set_members(self, members, competitors):
+        '''ids of every server member and of the competitors among them, the frame is rebuilt'''
+        self.members = set(map(str, members))
+        self.competitors = set(map(str, competitors))
+        self.frame = self.build_frame()
+
+    def update_member(self, user_id, member, competitor):
+        '''one member joined, left or changed roles'''
         user_id = str(user_id)
-        self.data[user_id] = {}
-        return True
+        if member: self.members.add(user_id)
+        else: self.members.discard(user_id)
+        if competitor: self.competitors.add(user_id)
+        else: self.competitors.discard(user_id)
+
+        if user_id in self.frame.index:
+            # rows without data are only there for competitors
+            if not competitor and user_id not in self.data: self.frame = self.frame.drop(index=user_id)
+            else: self.frame.at[user_id, COMPETITOR_KEY] = self.competitor_value(user_id)
+        elif competitor:
+            self.add_rows([user_id])
 
     def set_user_data(self, user_id, key, value):
         user_id = str(user_id)
@@ -56,14 +188,64 @@ class user_data:
             self.create_user(user_id)
         if key in self.keys:
             self.data[user_id][key] = value
+            self.frame.at[user_id, key] = str(value)
+            if key == BIRTHDAY_KEY: self.index_birthday(user_id, value)
             self.store_data()
             return True
         else:
             return False
 
+    def set_many(self, updates):
+        '''applies [(user_id, key, value)] and stores once, a value of None clears the key. returns how many were applied'''
+        updates = [(str(user_id), key, value) for user_id, key, value in updates]
+        applied = 0
+        with self.batch():
+            self.create_users(user_id for user_id, _, _ in updates)
+            for user_id, key, value in updates:
+                if value is None: applied += self.delete_user_data(user_id, key)
+                else: applied += self.set_user_data(user_id, key, value)
+        return applied
+
+    def delete_user_data(self, user_id, key):
+        user_id = str(user_id)
+        if key not in self.data.get(user_id, {}):
+            return False
+        del self.data[user_id][key]
+        if key in self.keys: self.frame.at[user_id, key] = "-"
+        if key == BIRTHDAY_KEY: self.index_birthday(user_id, None)
+        self.store_data()
+        return True
+
+    def index_birthdays(self):
+        '''rebuilds the birthday index from the data, it stays empty while BIRTHDAY_KEY isn't one of the keys'''
+        self.birthdays, self.user_birthdays, self.birthday_days = {}, {}, []
+        if BIRTHDAY_KEY not in self.keys: return
+        for user_id, values in self.data.items():
+            if BIRTHDAY_KEY in values: self.index_birthday(user_id, values[BIRTHDAY_KEY])
+
+    def index_birthday(self, user_id, value):
+        '''files user_id under the day of value, None takes them out of the index'''
+        old = self.user_birthdays.pop(user_id, None)
+        if old is not None:
+            self.birthdays[old].discard(user_id)
+            if not self.birthdays[old]:
+                del self.birthdays[old]
+                self.birthday_days.remove(old)
+
+        new = parse_birthday(value) if value is not None else None
+        if new is None: return
+        self.user_birthdays[user_id] = new
+        if new not in self.birthdays:
+            self.birthdays[new] = set()
+            insort(self.birthday_days, new)
+        self.birthdays[new].add(user_id)
+
     def add_key(self, key):
         if key not in self.keys:
             self.keys.append(key)
+            # values kept from before the key was removed come back with it
+            self.frame[key] = [str(self.data[user_id][key]) if key in self.data.get(user_id, {}) else "-" for user_id in self.frame.index]
+            if key == BIRTHDAY_KEY: self.index_birthdays()
             self.store_data()
             return True
         else:
@@ -72,6 +254,8 @@ class user_data:
     def remove_key(self, key):
         if key in self.keys:
             self.keys.remove(key)
+            self.frame = self.frame.drop(columns=key)
+            if key == BIRTHDAY_KEY: self.index_birthdays()
             self.store_data()
             return True
         else:
@@ -85,7 +269,10 @@ class user_data:
             log_error(e)
             return False
 
+        birthdays_kept = (BIRTHDAY_KEY in self.keys) == (BIRTHDAY_KEY in keys)
         self.keys = keys 
+        self.frame = self.build_frame()
+        if not birthdays_kept: self.index_birthdays()
         self.store_data()
         return True
 
@@ -97,13 +284,15 @@ class user_data:
             ws = None
 
         if ws is None:
-            return False 
-        
+            return None 
         
-        ws.resize(cols=len(df.columns), rows=len(df.index) + 1)
-        ws.update(values=[df.columns.values.tolist()] + df.values.tolist(), range_name=None, value_input_option='USER_ENTERED')
+        batch = sheet_batch(self.SHEET)
+        cells = batch.sync(ws, [df.columns.values.tolist()] + df.values.tolist(), self.snapshots)
+        batch.flush()
 
-        return True 
+        return cells 
 
     def get_df(self):
-        return get_as_dataframe(self.SHEET.worksheet(WORKSHEET_NAME), evaluate_formulas=False, parse_dates=False).fillna("").astype(str)
+        ws = self.SHEET.worksheet(WORKSHEET_NAME)
+        self.snapshots.pop(ws.id, None)
+        return get_as_dataframe(ws, evaluate_formulas=False, parse_dates=False).fillna("").astype(str)